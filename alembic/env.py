@@ -2,6 +2,7 @@ from logging.config import fileConfig
 
 from sqlalchemy import create_engine
 from sqlalchemy import pool
+from sqlalchemy.sql.elements import BinaryExpression, CollationClause
 
 from alembic import context
 
@@ -28,6 +29,17 @@ if config.config_file_name is not None:
 # ... etc.
 
 
+def include_object(object, name, type_, reflected, compare_to):
+    """Leave indexes on collated expressions out of autogenerate: reflection drops the COLLATE
+    of index expressions, so they would never compare equal to the metadata"""
+    if type_ == "index":
+        index = object if not reflected else compare_to
+        if index is not None and any(isinstance(e, BinaryExpression) and isinstance(e.right, CollationClause)
+                                     for e in index.expressions):
+            return False
+    return True
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -46,6 +58,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -63,7 +76,7 @@ def run_migrations_online() -> None:
 
     with engine.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata, include_object=include_object
         )
 
         with context.begin_transaction():
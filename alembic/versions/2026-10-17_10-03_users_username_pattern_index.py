@@ -0,0 +1,27 @@
+"""users-username-pattern-index
+
+Revision ID: c4a81f6e2d07
+Revises: 5b0e7d2c9f41
+Create Date: 2026-10-17 10:03:12.274816
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a81f6e2d07'
+down_revision: Union[str, None] = '5b0e7d2c9f41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # text_pattern_ops lets LIKE 'prefix%' use the index regardless of the db collation
+    op.execute('CREATE INDEX ix_users_username_pattern ON users (lower(username) text_pattern_ops)')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_username_pattern', table_name='users')
@@ -0,0 +1,29 @@
+"""users-username-c-collation
+
+Revision ID: 5d7e3a9b2c60
+Revises: 8e2d4b7c1f03
+Create Date: 2026-10-17 19:40:51.603127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d7e3a9b2c60'
+down_revision: Union[str, None] = '8e2d4b7c1f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the C collation serves LIKE 'prefix%' like text_pattern_ops did, and the ORDER BY of the search too
+    op.drop_index('ix_users_username_pattern', table_name='users')
+    op.create_index('ix_users_username_pattern', 'users', [sa.text('lower(username) COLLATE "C"'), 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_username_pattern', table_name='users')
+    op.execute('CREATE INDEX ix_users_username_pattern ON users (lower(username) text_pattern_ops)')
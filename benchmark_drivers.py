@@ -0,0 +1,87 @@
+"""Compare the time of the read functions of src.api on each postgres driver, sync and async.
+
+Run against a populated db, see populate_db.py. pg8000 is only a dev dependency, see requirements/dev.in
+python benchmark_drivers.py
+"""
+import asyncio
+import time
+
+from sqlalchemy import create_engine, make_url, select
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src import api
+from src.config import get_config
+from src.sqlalchemy import tables
+from src.sqlalchemy.connection import engine
+
+REPEAT = 50
+
+READS = {
+    "read_user": lambda conn, ids: api.read_user(conn, id=ids["user_id"]),
+    "read_leaders": lambda conn, ids: api.read_leaders(conn, ids["user_id"]),
+    "read_follow_counts": lambda conn, ids: api.read_follow_counts(conn, ids["user_id"]),
+    "read_goals": lambda conn, ids: api.read_goals(conn, user_id=ids["user_id"]),
+    "read_announcements": lambda conn, ids: api.read_announcements(conn, ids["user_id"]),
+    "read_feed": lambda conn, ids: api.read_feed(conn, ids["user_id"]),
+    "read_comments": lambda conn, ids: api.read_comments(conn, goal_id=ids["goal_id"]),
+    "read_unread_comments": lambda conn, ids: api.read_unread_comments(conn, ids["user_id"]),
+}
+
+
+def driver_url(drivername: str) -> URL:
+    url = make_url(get_config()["db"]["url"]).set(drivername=drivername)
+    query = dict(url.query)
+    # pg8000 takes the path of the socket file, the other drivers the directory it is in
+    if drivername == "postgresql+pg8000" and "host" in query:
+        query["unix_sock"] = query.pop("host") + "/.s.PGSQL.5432"
+    return url.set(query=query)
+
+
+def time_reads(conn, ids) -> dict[str, float]:
+    """The fastest of REPEAT runs of each read, in milliseconds, after one run to prepare the statements"""
+    timings = {}
+    for name, read in READS.items():
+        read(conn, ids)
+        runs = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            read(conn, ids)
+            runs.append(time.perf_counter() - start)
+        timings[name] = min(runs) * 1e3
+    return timings
+
+
+def time_sync(drivername: str, ids) -> dict[str, float]:
+    with create_engine(driver_url(drivername)).connect() as conn:
+        return time_reads(conn, ids)
+
+
+async def time_async(drivername: str, ids) -> dict[str, float]:
+    async_engine = create_async_engine(driver_url(drivername))
+    async with async_engine.connect() as conn:
+        timings = await conn.run_sync(time_reads, ids)
+    await async_engine.dispose()
+    return timings
+
+
+if __name__ == "__main__":
+    with engine.connect() as conn:
+        user_id = conn.execute(select(tables.follows.c.follower_id).limit(1)).scalar()
+        goal_id = conn.execute(
+            select(tables.comments.c.goal_id).group_by(tables.comments.c.goal_id).order_by(
+                tables.comments.c.goal_id).limit(1)).scalar()
+    ids = dict(user_id=user_id, goal_id=goal_id)
+
+    timings = {
+        "psycopg2": time_sync("postgresql+psycopg2", ids),
+        "pg8000": time_sync("postgresql+pg8000", ids),
+        "psycopg": time_sync("postgresql+psycopg", ids),
+        "asyncpg": asyncio.run(time_async("postgresql+asyncpg", ids)),
+        "psycopg async": asyncio.run(time_async("postgresql+psycopg", ids)),
+    }
+
+    print("milliseconds, fastest of", REPEAT)
+    print(f"{'':<22}" + "".join(f"{driver:>15}" for driver in timings))
+    for name in READS:
+        print(f"{name:<22}" + "".join(f"{t[name]:>15.2f}" for t in timings.values()))
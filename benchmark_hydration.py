@@ -0,0 +1,67 @@
+"""Compare the cost per row of building enriched goals with pydantic validation and with api._goals_enriched.
+
+python benchmark_hydration.py
+"""
+from datetime import datetime, timezone
+import time
+from uuid import uuid4
+
+from sqlalchemy import func, literal, select
+
+from src import api
+from src.sqlalchemy import tables, utils
+from src.sqlalchemy.connection import engine
+from src.types import domain
+
+ROWS = 10_000
+REPEAT = 5
+
+now = datetime.now(timezone.utc)
+goal = dict(
+    id=uuid4(), user_id=uuid4(), parent_id=uuid4(), title="title", description="description",
+    due_date=now, is_completed=False, comment_count=3, created_at=now, updated_at=now)
+user = dict(id=goal["user_id"], username="username", email="u@a.b", created_at=now, updated_at=now)
+values = {
+    **{f"primary_{c.name}": (goal[c.name], c.type) for c in tables.goals.columns},
+    **{f"parent_{c.name}": (goal[c.name], c.type) for c in tables.goals.columns},
+    **{f"u_{c.name}": (user[c.name], c.type) for c in tables.users.columns},
+}
+
+
+def filter_by_prefix(row, prefix: str) -> dict:
+    return {k[len(prefix):]: v for k, v in row._mapping.items() if k.startswith(prefix)}
+
+
+def validated(result) -> list[domain.GoalEnriched]:
+    """The hydration before api._goals_enriched"""
+    return [
+        domain.GoalEnriched(
+            user=filter_by_prefix(row, "u_"),
+            parent=domain.Goal(**filter_by_prefix(row, "parent_")) if row.primary_parent_id else None,
+            **filter_by_prefix(row, "primary_"))
+        for row in result]
+
+
+def best_of(hydrate, frozen) -> float:
+    """The fastest of REPEAT runs, in microseconds per row"""
+    timings = []
+    for _ in range(REPEAT):
+        result = frozen()
+        start = time.perf_counter()
+        hydrate(result)
+        timings.append(time.perf_counter() - start)
+    return min(timings) / ROWS * 1e6
+
+
+if __name__ == "__main__":
+    stmt = (
+        select(*[literal(value, type_).label(name) for name, (value, type_) in values.items()])
+        .select_from(func.generate_series(1, ROWS)))
+    with engine.connect() as conn:
+        frozen = conn.execute(stmt).freeze()
+
+    assert validated(frozen()) == api._goals_enriched(frozen())
+    before, after = best_of(validated, frozen), best_of(api._goals_enriched, frozen)
+    print(f"{ROWS} enriched goals, microseconds per row")
+    print(f"validated: {before:.1f}")
+    print(f"trusted:   {after:.1f} ({before / after:.1f}x faster)")
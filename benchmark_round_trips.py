@@ -0,0 +1,87 @@
+"""Count the db round trips per request of the GET routes, reading in write transactions and with connect_read.
+
+Run against a populated db, see populate_db.py
+python benchmark_round_trips.py
+"""
+from collections import Counter
+from contextlib import asynccontextmanager
+from unittest.mock import patch
+
+import asyncpg
+from fastapi.testclient import TestClient
+from sqlalchemy import select, text
+
+from src import api
+from src.app import app
+from src.sqlalchemy import tables
+from src.sqlalchemy.connection import engine, read_engine
+
+round_trips = Counter()
+
+
+def counted(method):
+    """Count the calls of an asyncpg method that waits on a reply from the db"""
+    async def wrapper(*args, **kwargs):
+        round_trips[method.__name__] += 1
+        return await method(*args, **kwargs)
+    return wrapper
+
+
+@asynccontextmanager
+async def begin_read():
+    """The read connection before connect_read"""
+    async with read_engine().begin() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def begin_read_only():
+    """The read only transaction before asyncpg's BEGIN READ ONLY"""
+    async with begin_read() as conn:
+        await conn.execute(text("SET TRANSACTION READ ONLY"))
+        yield conn
+
+
+def per_request(client, urls) -> dict[str, int]:
+    """The round trips of each url, once asyncpg has prepared the statements it caches"""
+    trips = {}
+    for url in urls:
+        assert client.get(url).status_code == 200, url
+        round_trips.clear()
+        client.get(url)
+        trips[url] = sum(round_trips.values())
+    return trips
+
+
+if __name__ == "__main__":
+    with engine.connect() as conn:
+        user_id = conn.execute(select(tables.follows.c.follower_id).limit(1)).scalar()
+        goal_ids = [g.id for g in api.read_goals(conn, user_id=user_id, limit=2)]
+    goal_params = "&".join(f"goal_ids={id}" for id in goal_ids)
+    urls = [
+        f"/0/users/{user_id}",
+        f"/0/users/leaders/{user_id}",
+        f"/0/follows/counts/{user_id}",
+        f"/0/goals?user_id={user_id}",
+        f"/0/goals/announcements/{user_id}",
+        f"/0/reactions?{goal_params}",
+        f"/0/comments/count?{goal_params}",
+        f"/0/comments/unread/count/{user_id}",
+        f"/0/feed/{user_id}",
+    ]
+
+    with (patch.object(asyncpg.Connection, "execute", counted(asyncpg.Connection.execute)),
+          patch.object(asyncpg.Connection, "prepare", counted(asyncpg.Connection.prepare)),
+          patch("asyncpg.prepared_stmt.PreparedStatement.fetch", counted(asyncpg.prepared_stmt.PreparedStatement.fetch)),
+          TestClient(app) as client):
+        with (patch("src.routes.v0.connect_read", begin_read),
+              patch("src.routes.v0.begin_read_only", begin_read_only)):
+            before = per_request(client, urls)
+        after = per_request(client, urls)
+
+    print("round trips per request")
+    print(f"{'':<35} before  after")
+    for url in urls:
+        route = url.split("?")[0].replace(str(user_id), "{user_id}")
+        print(f"{route:<35} {before[url]:>6} {after[url]:>6}")
+    print(f"{'total':<35} {sum(before.values()):>6} {sum(after.values()):>6}")
@@ -0,0 +1,68 @@
+"""Compare the time to encode 1k enriched goals as a response body, the ways a route can do it.
+
+python benchmark_serialization.py
+"""
+from datetime import datetime, timezone
+import json
+import time
+from uuid import uuid4
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from src.responses import ORJSONResponse
+from src.sqlalchemy import utils
+from src.types import domain
+
+GOALS = 1_000
+REPEAT = 10
+
+now = datetime.now(timezone.utc)
+user = utils.from_row(
+    domain.User, dict(id=uuid4(), username="username", email="u@a.b", created_at=now, updated_at=now))
+parent = utils.from_row(
+    domain.Goal, dict(id=uuid4(), user_id=user.id, description="goal", is_completed=False, created_at=now, updated_at=now))
+goals = [
+    utils.from_row(
+        domain.GoalEnriched,
+        dict(id=uuid4(), user_id=user.id, parent_id=parent.id, title="title", description="milestone " * 10,
+             due_date=now, is_completed=False, comment_count=3, created_at=now, updated_at=now),
+        user=user, parent=parent)
+    for _ in range(GOALS)]
+adapter = TypeAdapter(list[domain.GoalEnriched])
+
+
+def default_json_response(goals) -> bytes:
+    """response_model validation, then JSONResponse, as FastAPI 0.111 does"""
+    validated = adapter.validate_python(goals, from_attributes=True)
+    content = jsonable_encoder(adapter.dump_python(validated, mode="json"))
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+def orjson_response(goals) -> bytes:
+    """response_model validation, then the app's default ORJSONResponse"""
+    validated = adapter.validate_python(goals, from_attributes=True)
+    return ORJSONResponse(adapter.dump_python(validated, mode="json")).body
+
+
+def trusted_orjson_response(goals) -> bytes:
+    """No response_model validation, see routes.v0.trusted_response"""
+    return ORJSONResponse(goals).body
+
+
+def best_of(encode) -> float:
+    """The fastest of REPEAT runs, in milliseconds"""
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        encode(goals)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1e3
+
+
+if __name__ == "__main__":
+    expected = default_json_response(goals)
+    print(f"{GOALS} enriched goals, milliseconds")
+    for encode in (default_json_response, orjson_response, trusted_orjson_response):
+        assert encode(goals) == expected, encode.__name__
+        print(f"{encode.__name__:<25} {best_of(encode):.2f}")
@@ -2,7 +2,7 @@ from uuid import UUID
 from tests import utils
 from src.sqlalchemy.connection import engine
 from src.types import domain
-from src.api import create_user
+from src.api import create_user, repair_follow_counts, repair_comment_counts
 
 def populate_db():
     utils.delete_all_entries_from_db()
@@ -20,9 +20,11 @@ def populate_db():
         for u in users:
             reactions = utils.create_reactions_for_tests(conn, u, goals + milestones, 1)
             comments += utils.create_comments_for_tests(conn, u, goals, 1)
-        
-        unread_comments = utils.create_unread_comments_for_tests(conn, comments, [u.id for u in users])
+
         utils.create_follows_for_tests(conn, users)
+        # the test utils insert follows and comments directly, so count them afterwards
+        repair_follow_counts(conn)
+        repair_comment_counts(conn)
         conn.commit()
     return users
 
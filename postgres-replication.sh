@@ -0,0 +1,3 @@
+#!/bin/sh
+# Runs once when the postgres container initializes its data dir: lets postgres-replica stream from it.
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"
@@ -0,0 +1,11 @@
+import structlog
+
+from src import api
+from src.sqlalchemy.connection import engine
+
+log = structlog.get_logger()
+
+# recompute the denormalized counters from their source tables
+with engine.begin() as conn:
+    log.info("Repaired follow counts", users=api.repair_follow_counts(conn))
+    log.info("Repaired comment counts", goals=api.repair_comment_counts(conn))
@@ -1,24 +1,26 @@
 from collections import defaultdict
+from datetime import timedelta
 from uuid import UUID
 
 from sqlalchemy.dialects.postgresql import insert as pg_insert
-from sqlalchemy import select, insert, delete, and_, or_, desc, update, case, union, Table, Row, func, literal
-from sqlalchemy.engine import Connection
+from sqlalchemy import select, insert, delete, and_, or_, desc, update, case, union, union_all, Table, Column, ColumnElement, Select, Text, bindparam, func, literal, true, tuple_, FromClause, Insert
+from sqlalchemy.engine import Connection, Result
 
 from src.sqlalchemy import tables, utils
 from src.types import domain, requests
-from src.push_notifications import send_message
 
 
 # exclude these fields from create functions
 EXCLUDED_FIELDS = {"created_at", "updated_at"}
+# how many levels of milestones read_goal_tree reads at most
+MAX_TREE_DEPTH = 10
 
 ### USERS
 
 def create_user(conn: Connection, user: domain.User) -> domain.User:
     stmt = insert(tables.users).values(**user.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True)).returning(tables.users)
-    inserted = conn.execute(stmt).fetchone()._mapping
-    return domain.User(**inserted)
+    inserted = conn.execute(stmt).fetchone()
+    return utils.from_row(domain.User, inserted)
 
 def read_user(
         conn: Connection,
@@ -37,52 +39,132 @@ def read_user(
     result = conn.execute(stmt).fetchone()
     if result is None:
         return
-    return domain.User(**result._mapping)
+    return utils.from_row(domain.User, result)
 
-def search_users(conn: Connection, user_id: UUID) -> list[domain.UserEnriched]:
-    stmt = (
-        select(tables.users, 
-               case((tables.follows.c.leader_id == None, False),
-                    else_=True).label('leader'))
-        .select_from(tables.users)
-        .outerjoin(tables.follows, 
-                   (tables.users.c.id == tables.follows.c.leader_id) 
-                   & (tables.follows.c.follower_id == user_id))
+def search_users(
+        conn: Connection,
+        user_id: UUID,
+        q: str = "",
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> list[domain.UserEnriched]:
+    """Find users whose username starts with q (case insensitive): the user's leaders first, then everyone else,
+    each in username order. Both parts are read in the order of their index and stop after a page of matches,
+    and the cursor (see utils.next_search_cursor) resumes after the last user of the previous page."""
+    limit = min(limit, utils.MAX_PAGE_SIZE)
+    username = func.lower(tables.users.c.username).collate('C')
+    prefix = username.like(utils.escape_like(q.lower()) + "%")
+    is_leader = (tables.follows.c.follower_id == user_id) & (tables.follows.c.leader_id == tables.users.c.id)
+    leaders = (
+        select(tables.users, literal(True).label('leader'))
+        .join(tables.follows, is_leader)
+        .where(prefix)
+        .order_by(username, tables.users.c.id)
+        .limit(limit)
+        )
+    others = (
+        select(tables.users, literal(False).label('leader'))
         .where(tables.users.c.id != user_id)
+        .where(prefix)
+        .where(~select(tables.follows).where(is_leader).exists())
+        .order_by(username, tables.users.c.id)
+        .limit(limit)
+        )
+    if cursor:
+        after_leader, after_username, after_id = utils.decode_search_cursor(cursor)
+        after = tuple_(username, tables.users.c.id) > tuple_(func.lower(after_username).collate('C'), after_id)
+        if after_leader:
+            leaders = leaders.where(after)
+        else:
+            leaders, others = None, others.where(after)
+    parts = [part.subquery().select() for part in (leaders, others) if part is not None]
+    page = union_all(*parts).subquery()
+    stmt = (
+        select(page)
+        .order_by(page.c.leader.desc(), func.lower(page.c.username).collate('C'), page.c.id)
+        .limit(limit)
         )
     result = conn.execute(stmt).all()
-    users = [domain.UserEnriched(**row._mapping) for row in result]
+    users = [utils.from_row(domain.UserEnriched, row) for row in result]
     return users
 
-def read_followers(conn: Connection, leader_id: UUID) -> list[domain.UserEnriched]:
+def read_followers(
+        conn: Connection,
+        leader_id: UUID,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> list[domain.UserEnriched]:
     '''find all of the followers, and determine if they are also a leader'''
+    stmt, _ = _select_followers(leader_id)
+    stmt = utils.paginate(stmt, tables.users.c.created_at, tables.users.c.id, limit, cursor)
+
+    result = conn.execute(stmt).all()
+    users = [utils.from_row(domain.UserEnriched, row) for row in result]
+    return users
+
+def read_followers_json(
+        conn: Connection,
+        leader_id: UUID,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> utils.JsonPage:
+    """read_followers rendered as JSON by the db"""
+    stmt, leader = _select_followers(leader_id)
+    json = utils.json_object(
+        domain.UserEnriched, tables.users, follower=literal("true", Text), leader=utils.json_value(leader))
+    stmt = utils.paginate_json(
+        stmt.with_only_columns(json.label("json")), tables.users.c.created_at, tables.users.c.id, limit, cursor)
+    return utils.json_page(conn.execute(stmt).one(), limit)
+
+def _select_followers(leader_id: UUID) -> tuple[Select, ColumnElement[bool]]:
+    """Select the followers of a user, and whether the user follows them back"""
     f0 = tables.follows.alias('f0')
     f1 = tables.follows.alias('f1')
+    leader = case((f1.c.leader_id == None, False), else_=True)
     stmt = (
         select(tables.users,
                literal(True).label('follower'),
-               case((f1.c.leader_id == None, False),
-                    else_=True).label('leader'))
+               leader.label('leader'))
         .select_from(tables.users)
         .join(f0, f0.c.follower_id == tables.users.c.id)
         .outerjoin(f1, (f1.c.leader_id == tables.users.c.id) & (f1.c.follower_id == leader_id))
         .where(f0.c.leader_id == leader_id))
-
-    result = conn.execute(stmt).all()
-    users = [domain.UserEnriched(**row._mapping) for row in result]
-    return users
+    return stmt, leader
 
 
-def read_leaders(conn: Connection, follower_id: UUID) -> list[domain.UserEnriched]:
+def read_leaders(
+        conn: Connection,
+        follower_id: UUID,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> list[domain.UserEnriched]:
     stmt = select(tables.users) \
         .select_from(tables.users) \
         .join(tables.follows, tables.users.c.id == tables.follows.c.leader_id) \
         .where(tables.follows.c.follower_id == follower_id)
+    stmt = utils.paginate(stmt, tables.users.c.created_at, tables.users.c.id, limit, cursor)
     result = conn.execute(stmt).all()
-    leaders = [domain.UserEnriched(leader=True, **row._mapping) for row in result]
+    leaders = [utils.from_row(domain.UserEnriched, row, leader=True) for row in result]
     return leaders
 
 def delete_user(conn: Connection, user_id: UUID) -> None:
+    # the user's follows are deleted by cascade, so uncount them for the other side first
+    conn.execute(
+        update(tables.user_stats)
+        .values(followers=tables.user_stats.c.followers - 1)
+        .where(tables.user_stats.c.user_id.in_(
+            select(tables.follows.c.leader_id).where(tables.follows.c.follower_id == user_id))))
+    conn.execute(
+        update(tables.user_stats)
+        .values(leaders=tables.user_stats.c.leaders - 1)
+        .where(tables.user_stats.c.user_id.in_(
+            select(tables.follows.c.follower_id).where(tables.follows.c.leader_id == user_id))))
+    # and so are the user's comments, so uncount them on the goals of other users
+    comments = (
+        select(tables.comments.c.goal_id, func.count().label("count"))
+        .where(tables.comments.c.user_id == user_id)
+        .group_by(tables.comments.c.goal_id)
+        .subquery())
+    conn.execute(
+        update(tables.goals)
+        .values(comment_count=tables.goals.c.comment_count - comments.c.count)
+        .where(tables.goals.c.id == comments.c.goal_id))
     stmt = delete(tables.users).where(tables.users.c.id == user_id)
     conn.execute(stmt)
 
@@ -93,46 +175,201 @@ def create_follow(conn: Connection, follow: domain.Follow) -> domain.Follow:
         .values(**follow.model_dump(exclude=EXCLUDED_FIELDS)) \
         .returning(tables.follows)
     follow = conn.execute(stmt).fetchone()
-    return domain.Follow(**follow._mapping)
+    update_follow_counts(conn, follow.follower_id, follow.leader_id, 1)
+    return utils.from_row(domain.Follow, follow)
 
 def delete_follow(conn: Connection, follow: domain.Follow) -> None:
     stmt = delete(tables.follows).where(
         and_(tables.follows.c.follower_id == follow.follower_id,
-             tables.follows.c.leader_id == follow.leader_id))
+             tables.follows.c.leader_id == follow.leader_id)) \
+        .returning(tables.follows.c.follower_id)
+    deleted = conn.execute(stmt).fetchone()
+    if deleted is not None:
+        update_follow_counts(conn, follow.follower_id, follow.leader_id, -1)
+
+def update_follow_counts(conn: Connection, follower_id: UUID, leader_id: UUID, delta: int) -> None:
+    """Add delta to the leader's follower count and to the follower's leader count"""
+    counts = defaultdict(lambda: {"followers": 0, "leaders": 0})
+    counts[leader_id]["followers"] += delta
+    counts[follower_id]["leaders"] += delta
+    # upsert in user_id order so concurrent follows lock the rows in the same order
+    stmt = pg_insert(tables.user_stats).values(
+        [{"user_id": user_id, **counts[user_id]} for user_id in sorted(counts)])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tables.user_stats.c.user_id],
+        set_={"followers": tables.user_stats.c.followers + stmt.excluded.followers,
+              "leaders": tables.user_stats.c.leaders + stmt.excluded.leaders,
+              "updated_at": func.now()})
     conn.execute(stmt)
 
 def read_follow_counts(conn: Connection, user_id: UUID) -> domain.FollowCounts:
     stmt = (
-        select(
-            case((tables.follows.c.follower_id == user_id, "leaders"),
-                 else_="followers").label("type"),
-            func.count().label("count")
-        )
-        .select_from(tables.follows)
-        .where(or_(tables.follows.c.leader_id == user_id,
-                   tables.follows.c.follower_id == user_id))
-        .group_by("type"))
-    result = conn.execute(stmt).all()
-    
-    return domain.FollowCounts(**{row.type: row.count for row in result})
+        select(tables.user_stats.c.followers, tables.user_stats.c.leaders)
+        .where(tables.user_stats.c.user_id == user_id))
+    result = conn.execute(stmt).fetchone()
+    if result is None:
+        return domain.FollowCounts()
+    return utils.from_row(domain.FollowCounts, result)
+
+def repair_follow_counts(conn: Connection) -> int:
+    """Recount follows for every user, fixing any drift in user_stats. Returns the number of repaired users."""
+    followers = (
+        select(func.count())
+        .where(tables.follows.c.leader_id == tables.users.c.id)
+        .scalar_subquery())
+    leaders = (
+        select(func.count())
+        .where(tables.follows.c.follower_id == tables.users.c.id)
+        .scalar_subquery())
+    stmt = pg_insert(tables.user_stats).from_select(
+        ["user_id", "followers", "leaders"],
+        select(tables.users.c.id, followers, leaders))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tables.user_stats.c.user_id],
+        set_={"followers": stmt.excluded.followers,
+              "leaders": stmt.excluded.leaders,
+              "updated_at": func.now()},
+        where=or_(tables.user_stats.c.followers != stmt.excluded.followers,
+                  tables.user_stats.c.leaders != stmt.excluded.leaders))
+    return conn.execute(stmt).rowcount
 
 ### GOALS
 
+def create_goals(conn: Connection, goals: list[domain.Goal]) -> list[domain.Goal]:
+    """Create goals and subscribe their owners to their comments, in one statement. 
+    Goals may be milestones of goals created with them."""
+    new_goals = (
+        insert(tables.goals)
+        # the same keys for every row of a multi-row insert, so None is inserted as NULL
+        .values([goal.model_dump(exclude=EXCLUDED_FIELDS) for goal in goals])
+        .returning(tables.goals)
+        .cte("new_goals"))
+    owner_subs = [domain.CommentSub(goal_id=goal.id, user_id=goal.user_id) for goal in goals]
+    owner_subs = (
+        pg_insert(tables.comment_subs)
+        .values([sub.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True) for sub in owner_subs])
+        .on_conflict_do_nothing(constraint='uq_user_goal')
+        .cte("owner_subs"))
+    stmt = select(new_goals).add_cte(owner_subs)
+    inserted = {row.id: row for row in conn.execute(stmt)}
+    return [utils.from_row(domain.Goal, inserted[goal.id]) for goal in goals]
+
 def create_goal(conn: Connection, goal: domain.Goal) -> domain.Goal:
-    stmt = insert(tables.goals).values(**goal.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True)).returning(tables.goals)
-    inserted = conn.execute(stmt).fetchone()
-    return domain.Goal(**inserted._mapping)
+    return create_goals(conn, [goal])[0]
+
+def create_goal_with_milestones(conn: Connection, goal: domain.Goal, milestones: list[requests.NewMilestone]) -> list[domain.Goal]:
+    """Create a goal and its milestones in one statement, e.g. from an onboarding template. Returns the goal first."""
+    milestones = [domain.Goal(user_id=goal.user_id, parent_id=goal.id, **m.model_dump()) for m in milestones]
+    return create_goals(conn, [goal, *milestones])
+
+def _select_goals_enriched(primary: Table, parent: Table):
+    """Select goals with their user and parent goal, using prefixed column names"""
+    return (select(
+                *utils.prefix(primary, "primary_"),
+                *utils.prefix(parent, "parent_"),
+                *utils.prefix(tables.users, "u_"))
+            .select_from(primary)
+            .join(tables.users)
+            .outerjoin(parent, primary.c.parent_id == parent.c.id))
+
+def _goals_enriched(result: Result) -> list[domain.GoalEnriched]:
+    primary, parent, user = (utils.columns_by_prefix(result.keys(), p) for p in ("primary_", "parent_", "u_"))
+    goals = []
+    for row in result:
+        parent_values = utils.pick(row, parent)
+        goals.append(utils.from_row(
+            domain.GoalEnriched, utils.pick(row, primary),
+            user=utils.from_row(domain.User, utils.pick(row, user)),
+            parent=utils.from_row(domain.Goal, parent_values) if parent_values["id"] else None))
+    return goals
+
+def _goal_enriched_json(primary: Table, parent: Table) -> ColumnElement[str]:
+    return utils.json_object(
+        domain.GoalEnriched, primary,
+        user=utils.json_object(domain.User, tables.users),
+        parent=case((parent.c.id == None, literal("null", Text)), else_=utils.json_object(domain.Goal, parent)))
+
+def _is_announcement(goals: Table):
+    """Goals and completed milestones are announced, open milestones are not"""
+    return or_(goals.c.parent_id == None, goals.c.is_completed)
 
 def read_goals(
         conn: Connection, 
         user_id: UUID = None, 
         goal_ids: list[UUID] = None,
         parent_id: UUID = None, 
-        announcements_only: bool = False
+        announcements_only: bool = False,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None
     ) -> list[domain.GoalEnriched]:
     primary = tables.goals.alias('primary')
     parent = tables.goals.alias('parent')
+    query = _select_goals(primary, parent, user_id, goal_ids, parent_id, announcements_only)
+    query = utils.paginate(query, primary.c.created_at, primary.c.id, limit, cursor)
+    
+    goals = _goals_enriched(conn.execute(query))
+    return goals
 
+def read_goals_json(
+        conn: Connection, 
+        user_id: UUID = None, 
+        goal_ids: list[UUID] = None,
+        parent_id: UUID = None, 
+        announcements_only: bool = False,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None
+    ) -> utils.JsonPage:
+    """read_goals rendered as JSON by the db"""
+    primary = tables.goals.alias('primary')
+    parent = tables.goals.alias('parent')
+    query = (
+        _select_goals(primary, parent, user_id, goal_ids, parent_id, announcements_only)
+        .with_only_columns(_goal_enriched_json(primary, parent).label("json")))
+    query = utils.paginate_json(query, primary.c.created_at, primary.c.id, limit, cursor)
+    return utils.json_page(conn.execute(query).one(), limit)
+
+def read_goal_tree(conn: Connection, goal_id: UUID, max_depth: int = MAX_TREE_DEPTH) -> domain.GoalTree | None:
+    """A goal and its milestones, recursively, down to max_depth levels below the goal. 
+    Each node counts its direct milestones and the completed ones, even at max_depth, where they are not read."""
+    tree = (
+        select(tables.goals, literal(0).label("depth"))
+        .where(tables.goals.c.id == goal_id)
+        .cte("tree", recursive=True))
+    tree = tree.union_all(
+        select(tables.goals, (tree.c.depth + 1).label("depth"))
+        .join(tree, tables.goals.c.parent_id == tree.c.id)
+        .where(tree.c.depth < max_depth))
+    milestones = tables.goals.alias("milestones")
+    counts = (
+        select(
+            func.count().label("milestone_count"),
+            func.count().filter(milestones.c.is_completed).label("completed_milestone_count"))
+        .where(milestones.c.parent_id == tree.c.id)
+        .lateral("counts"))
+    stmt = (
+        select(tree, counts)
+        .select_from(tree)
+        .join(counts, true())
+        .order_by(tree.c.depth, tree.c.created_at, tree.c.id))
+
+    # parents come before their milestones, so each node can be attached as it is built
+    nodes = {}
+    for row in conn.execute(stmt):
+        values = row._asdict()
+        del values["depth"]
+        node = utils.from_row(domain.GoalTree, values, milestones=[])
+        nodes[node.id] = node
+        if node.id != goal_id:
+            nodes[node.parent_id].milestones.append(node)
+    return nodes.get(goal_id)
+
+def _select_goals(
+        primary: Table, 
+        parent: Table, 
+        user_id: UUID | None, 
+        goal_ids: list[UUID] | None, 
+        parent_id: UUID | None, 
+        announcements_only: bool) -> Select:
     if [user_id, goal_ids, parent_id].count(None) != 2:
         raise ValueError("You must pass exactly one of user_id, goal_ids, or parent_id")
     if user_id:
@@ -142,37 +379,63 @@ def read_goals(
     if parent_id:
         filter = primary.c.parent_id == parent_id
 
-    query = (select(
-                    *utils.prefix(primary, "primary_"),
-                    *utils.prefix(parent, "parent_"),
-                    *utils.prefix(tables.users, "u_"))
-                  .select_from(primary)
-                  .join(tables.users)
-                  .outerjoin(parent, primary.c.parent_id == parent.c.id)
-                  .where(filter))
-    
-    result = conn.execute(query).all()
+    query = _select_goals_enriched(primary, parent).where(filter)
+    if announcements_only:
+        query = query.where(_is_announcement(primary))
+    return query
 
-    goals = []
-    for row in result:
-        condition = True
-        if announcements_only:
-            condition = row.primary_parent_id is None or row.primary_is_completed
-        if condition:
-            goals.append(domain.GoalEnriched(
-                user=utils.filter_by_prefix(row, "u_"),
-                parent=domain.Goal(**utils.filter_by_prefix(row, "parent_")) if row.primary_parent_id else None,
-                **utils.filter_by_prefix(row, "primary_")
-                ))
-    
-    return goals
+def read_announcements(
+        conn: Connection,
+        user_id: UUID,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> list[domain.GoalEnriched]:
+    """Read the goals and completed milestones of a user and their leaders, newest first"""
+    primary = tables.goals.alias('primary')
+    parent = tables.goals.alias('parent')
+    query = _select_announcements(primary, parent, user_id)
+    query = utils.paginate(query, primary.c.created_at, primary.c.id, limit, cursor)
 
-def read_announcements(conn: Connection, user_id: UUID) -> list[domain.GoalEnriched]:
-    announcements = read_goals(conn, user_id, announcements_only=True)
-    leaders = read_leaders(conn, user_id)
-    for leader in leaders:
-        announcements += read_goals(conn, leader.id, announcements_only=True)
-    return announcements
+    return _goals_enriched(conn.execute(query))
+
+def read_announcements_json(
+        conn: Connection,
+        user_id: UUID,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> utils.JsonPage:
+    """read_announcements rendered as JSON by the db"""
+    primary = tables.goals.alias('primary')
+    parent = tables.goals.alias('parent')
+    query = (
+        _select_announcements(primary, parent, user_id)
+        .with_only_columns(_goal_enriched_json(primary, parent).label("json")))
+    query = utils.paginate_json(query, primary.c.created_at, primary.c.id, limit, cursor)
+    return utils.json_page(conn.execute(query).one(), limit)
+
+def _select_announcements(primary: Table, parent: Table, user_id: UUID) -> Select:
+    # the user and their leaders, as one IN list, so each is looked up in ix_goals_announcements
+    user_ids = union_all(
+        select(tables.users.c.id).where(tables.users.c.id == user_id),
+        select(tables.follows.c.leader_id).where(tables.follows.c.follower_id == user_id))
+    return (
+        _select_goals_enriched(primary, parent)
+        .where(primary.c.user_id.in_(user_ids))
+        .where(_is_announcement(primary)))
+
+def read_feed(
+        conn: Connection,
+        user_id: UUID,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> list[domain.FeedItem]:
+    """Announcements with their reactions and comment counts, everything a feed screen renders"""
+    announcements = read_announcements(conn, user_id, limit=limit, cursor=cursor)
+    reactions = read_reactions(conn, [a.id for a in announcements])
+    feed = [
+        utils.from_row(
+            domain.FeedItem, dict(a),
+            reactions=reactions[a.id],
+            reacted=any(r.user_id == user_id for r in reactions[a.id]))
+        for a in announcements]
+    return feed
 
 def update_goal(conn: Connection, goal_id: UUID, updates: requests.UpdateGoal) -> domain.Goal:
     stmt = (
@@ -181,7 +444,7 @@ def update_goal(conn: Connection, goal_id: UUID, updates: requests.UpdateGoal) -
         .values(**updates.model_dump(exclude_none=True))
         .returning(tables.goals))
     updated = conn.execute(stmt).fetchone()
-    return domain.Goal(**updated._mapping)
+    return utils.from_row(domain.Goal, updated)
 
 def delete_goal(conn: Connection, goal_id: UUID) -> None:
     stmt = delete(tables.goals).where(tables.goals.c.id == goal_id)
@@ -196,14 +459,14 @@ def create_reaction(conn: Connection, reaction: domain.Reaction) -> domain.React
         .values(**reaction.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True))
         .returning(tables.reactions))
     inserted = conn.execute(stmt).fetchone()
-    return domain.Reaction(**inserted._mapping)
+    return utils.from_row(domain.Reaction, inserted)
 
 def read_reactions(conn: Connection, goal_ids: list[UUID]) -> dict[UUID, list[domain.Reaction]]:
     stmt = select(tables.reactions).where(tables.reactions.c.goal_id.in_(goal_ids))
     result = conn.execute(stmt).all()
     reactions = defaultdict(list)
     for row in result:
-        reactions[row.goal_id].append(domain.Reaction(**row._mapping))
+        reactions[row.goal_id].append(utils.from_row(domain.Reaction, row))
     return reactions
 
 def delete_reaction(conn: Connection, reaction_id: UUID) -> None:
@@ -219,10 +482,42 @@ def create_comment(conn: Connection, comment: domain.Comment) -> domain.Comment:
         .values(**comment.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True))
         .returning(tables.comments))
     inserted = conn.execute(stmt).fetchone()
-    return domain.Comment(**inserted._mapping)
+    update_comment_count(conn, inserted.goal_id, 1)
+    return utils.from_row(domain.Comment, inserted)
+
+def _comments_enriched(result: Result) -> list[domain.CommentEnriched]:
+    comment, user = (utils.columns_by_prefix(result.keys(), p) for p in ("c_", "u_"))
+    return [
+        utils.from_row(
+            domain.CommentEnriched, utils.pick(row, comment),
+            user=utils.from_row(domain.User, utils.pick(row, user)))
+        for row in result]
 
-def read_comments(conn: Connection, user_id: UUID = None, goal_id: UUID = None) -> list[domain.CommentEnriched]:
+def read_comments(
+        conn: Connection,
+        user_id: UUID = None,
+        goal_id: UUID = None,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> list[domain.CommentEnriched]:
+    stmt = _select_comments(user_id, goal_id)
+    stmt = utils.paginate(stmt, tables.comments.c.created_at, tables.comments.c.id, limit, cursor)
+    comments = _comments_enriched(conn.execute(stmt))
+    return comments
 
+def read_comments_json(
+        conn: Connection,
+        user_id: UUID = None,
+        goal_id: UUID = None,
+        limit: int = utils.PAGE_SIZE,
+        cursor: str = None) -> utils.JsonPage:
+    """read_comments rendered as JSON by the db"""
+    json = utils.json_object(
+        domain.CommentEnriched, tables.comments, user=utils.json_object(domain.User, tables.users))
+    stmt = _select_comments(user_id, goal_id).with_only_columns(json.label("json"))
+    stmt = utils.paginate_json(stmt, tables.comments.c.created_at, tables.comments.c.id, limit, cursor)
+    return utils.json_page(conn.execute(stmt).one(), limit)
+
+def _select_comments(user_id: UUID | None, goal_id: UUID | None) -> Select:
     if [user_id, goal_id].count(None) != 1:
         raise ValueError("You must pass exactly one of user_id, goal_id")
     if user_id:
@@ -230,37 +525,61 @@ def read_comments(conn: Connection, user_id: UUID = None, goal_id: UUID = None)
     elif goal_id:
         filter = tables.comments.c.goal_id == goal_id
     
-    stmt = (
-        select(tables.comments, *utils.prefix(tables.users, "u_"))
+    return (
+        select(*utils.prefix(tables.comments, "c_"), *utils.prefix(tables.users, "u_"))
         .join(tables.users)
         .where(filter))
-    result = conn.execute(stmt).all()
-    comments = [
-        domain.CommentEnriched(
-            user=utils.filter_by_prefix(row, "u_"),
-            **row._mapping)
-        for row in result]
-    return comments
 
 def delete_comment(conn: Connection, comment_id: UUID) -> None:
-    stmt = delete(tables.comments).where(tables.comments.c.id == comment_id)
+    stmt = (
+        delete(tables.comments)
+        .where(tables.comments.c.id == comment_id)
+        .returning(tables.comments.c.goal_id))
+    deleted = conn.execute(stmt).fetchone()
+    if deleted is not None:
+        update_comment_count(conn, deleted.goal_id, -1)
+
+def update_comment_count(conn: Connection, goal_id: UUID, delta: int) -> None:
+    stmt = (
+        update(tables.goals)
+        .values(comment_count=tables.goals.c.comment_count + delta)
+        .where(tables.goals.c.id == goal_id))
     conn.execute(stmt)
 
 def read_comment_count(conn: Connection, goal_id: UUID) -> domain.CommentCount:
-    stmt = select(func.count()).select_from(tables.comments).where(tables.comments.c.goal_id == goal_id)
+    stmt = select(tables.goals.c.comment_count).where(tables.goals.c.id == goal_id)
     result = conn.execute(stmt).scalar()
-    return domain.CommentCount(goal_id=goal_id, count=result)
+    return domain.CommentCount(goal_id=goal_id, count=result or 0)
+
+def read_comment_authors(conn: Connection, comment_ids: list[UUID]) -> dict[UUID, str]:
+    """Map comment ids to the username of their author"""
+    stmt = (
+        select(tables.comments.c.id, tables.users.c.username)
+        .join(tables.users)
+        .where(tables.comments.c.id.in_(comment_ids)))
+    result = conn.execute(stmt).all()
+    return {row.id: row.username for row in result}
 
 def read_comment_counts(conn: Connection, goal_ids: list[UUID]) -> list[domain.CommentCount]:
     stmt = (
-        select(tables.comments.c.goal_id, func.count())
-        .select_from(tables.comments)
-        .where(tables.comments.c.goal_id.in_(goal_ids))
-        .group_by(tables.comments.c.goal_id))
+        select(tables.goals.c.id, tables.goals.c.comment_count)
+        .where(tables.goals.c.id.in_(goal_ids)))
     result = conn.execute(stmt).all()
-    counts = [domain.CommentCount(goal_id=row.goal_id, count=row.count) for row in result]
+    counts = [domain.CommentCount(goal_id=row.id, count=row.comment_count) for row in result]
     return counts
 
+def repair_comment_counts(conn: Connection) -> int:
+    """Recount comments for every goal, fixing any drift in goals.comment_count. Returns the number of repaired goals."""
+    count = (
+        select(func.count())
+        .where(tables.comments.c.goal_id == tables.goals.c.id)
+        .scalar_subquery())
+    stmt = (
+        update(tables.goals)
+        .values(comment_count=count)
+        .where(tables.goals.c.comment_count != count))
+    return conn.execute(stmt).rowcount
+
 ### COMMENT SUBS AND UNREAD COMMENTS
 
 def create_comment_sub(conn: Connection, comment_sub: domain.CommentSub) -> domain.CommentSub:
@@ -272,115 +591,301 @@ def create_comment_sub(conn: Connection, comment_sub: domain.CommentSub) -> doma
     inserted = conn.execute(stmt).fetchone()
     if inserted is None:
         return
-    return domain.CommentSub(**inserted._mapping)
-
-def create_unread_comments(conn: Connection, comment: domain.Comment) -> list[domain.UnreadComment]:
-    """Create an unread comment for each comment sub, excluding the comment author."""
-    stmt = (
-        insert(tables.unread_comments)
-        .from_select(
-            [tables.unread_comments.c.user_id,
-             tables.unread_comments.c.goal_id,
-             tables.unread_comments.c.comment_id,
-             tables.unread_comments.c.read],
-            select(
-                tables.comment_subs.c.user_id,
-                literal(comment.goal_id),
-                literal(comment.id),
-                literal(False)
-            )
-            .select_from(tables.comment_subs)
-            .where(tables.comment_subs.c.goal_id == comment.goal_id)
-            .where(tables.comment_subs.c.user_id != comment.user_id)
-        )
-        .returning(tables.unread_comments))
-
-    inserted = conn.execute(stmt).fetchall()
-    unread_comments = [domain.UnreadComment(**row._mapping) for row in inserted]
-    return unread_comments
-
+    return utils.from_row(domain.CommentSub, inserted)
+
+def _is_after_read_watermark(created_at: Column, comment_id: Column) -> ColumnElement[bool]:
+    """Whether a comment is newer than the (last_read_at, last_read_comment_id) watermark of its comment sub.
+    Without a last_read_comment_id, comments created at last_read_at count as unread.
+
+    Known limitation: created_at is not the commit time. A comment whose transaction commits after the reader 
+    moved their watermark past a newer comment has an older created_at, so it counts as read without having 
+    been seen. create_comment_and_notify narrows the window to its one statement by stamping comments with 
+    clock_timestamp(), while create_comment stamps them with the start of its transaction."""
+    subs = tables.comment_subs
+    return or_(
+        created_at > subs.c.last_read_at,
+        and_(created_at == subs.c.last_read_at,
+             or_(subs.c.last_read_comment_id == None,
+                 comment_id > subs.c.last_read_comment_id)))
+
+def _select_unread_comments(*columns, user_id: UUID):
+    """Select the comments on a user's subscribed goals that are newer than the read watermark, excluding their own"""
+    return (
+        select(*columns)
+        .select_from(tables.comment_subs)
+        .join(tables.comments, tables.comments.c.goal_id == tables.comment_subs.c.goal_id)
+        .where(tables.comment_subs.c.user_id == user_id)
+        .where(tables.comments.c.user_id != user_id)
+        .where(_is_after_read_watermark(tables.comments.c.created_at, tables.comments.c.id)))
 
 def read_unread_comment_count(conn: Connection, user_id: UUID) -> int:
-    stmt = (
-        select(func.count())
-        .select_from(tables.unread_comments)
-        .where(tables.unread_comments.c.user_id == user_id)
-        .where(tables.unread_comments.c.read == False)
-    )
+    stmt = _select_unread_comments(func.count(), user_id=user_id)
     result = conn.execute(stmt).scalar()
     return result
 
 
-def update_unread_comments(conn: Connection, user_id: UUID, comment_ids: list[UUID], read: bool = True) -> None:
+def update_read_watermarks(conn: Connection, user_id: UUID, comment_ids: list[UUID]) -> None:
+    """Mark comments, and all older comments on the same goals, as read by moving the watermarks forward"""
+    # the newest of the given comments on each goal
+    latest = (
+        select(tables.comments.c.goal_id, tables.comments.c.id, tables.comments.c.created_at)
+        .where(tables.comments.c.id.in_(comment_ids))
+        .distinct(tables.comments.c.goal_id)
+        .order_by(tables.comments.c.goal_id, desc(tables.comments.c.created_at), desc(tables.comments.c.id))
+        .subquery())
     stmt = (
-        update(tables.unread_comments)
-        .values(read=read)
-        .where(tables.unread_comments.c.comment_id.in_(comment_ids))
-        .where(tables.unread_comments.c.user_id == user_id))
+        update(tables.comment_subs)
+        .values(last_read_at=latest.c.created_at, last_read_comment_id=latest.c.id)
+        .where(tables.comment_subs.c.user_id == user_id)
+        .where(tables.comment_subs.c.goal_id == latest.c.goal_id)
+        .where(_is_after_read_watermark(latest.c.created_at, latest.c.id)))
 
     conn.execute(stmt)
 
 
 def read_unread_comments(conn: Connection, user_id: UUID) -> list[domain.CommentEnriched]:
     stmt = (
-        select(
-            tables.comments, 
-            *utils.prefix(tables.users, "u_"))
-        .join(tables.comments, tables.unread_comments.c.comment_id == tables.comments.c.id)
+        _select_unread_comments(*utils.prefix(tables.comments, "c_"), *utils.prefix(tables.users, "u_"), user_id=user_id)
         .join(tables.users, tables.comments.c.user_id == tables.users.c.id)
-        .where(tables.unread_comments.c.user_id == user_id)
-        .where(tables.unread_comments.c.read == False))
-    result = conn.execute(stmt).all()
-    comments = [
-        domain.CommentEnriched(
-            user=utils.filter_by_prefix(row, "u_"),
-            **row._mapping)
-        for row in result]
+        .order_by(tables.comments.c.created_at, tables.comments.c.id))
+    comments = _comments_enriched(conn.execute(stmt))
     return comments
 
 
-def push_notify_unread_comments(conn: Connection, unread_comments: list[domain.UnreadComment]) -> list[domain.PushNotification]:
-    stmt = (
+def _select_notifications(comments: FromClause) -> Select:
+    """The push notifications of comments, for the active devices of the other subscribers of their goals"""
+    message = (
+        tables.users.c.username 
+        + " commented on your goal: " 
+        + func.left(comments.c.comment, 50))
+    return (
         select(
-            tables.devices.c.expo_push_token, 
             tables.devices.c.user_id.label("recipient_id"),
-            tables.users.c.id.label("commenter_id"), 
-            tables.users.c.username.label("commenter"), 
-            tables.comments.c.comment)
-        .select_from(tables.unread_comments)
-        .join(tables.devices, tables.unread_comments.c.user_id == tables.devices.c.user_id)
-        .join(tables.comments, tables.unread_comments.c.comment_id == tables.comments.c.id)
-        .join(tables.users, tables.comments.c.user_id == tables.users.c.id)
-        .where(tables.unread_comments.c.id.in_([uc.id for uc in unread_comments]))
-    )
-    result = conn.execute(stmt).all()
+            tables.devices.c.expo_push_token,
+            comments.c.goal_id,
+            comments.c.id.label("comment_id"),
+            message.label("message"))
+        .select_from(comments)
+        .join(tables.comment_subs, comments.c.goal_id == tables.comment_subs.c.goal_id)
+        .join(tables.devices, tables.comment_subs.c.user_id == tables.devices.c.user_id)
+        .join(tables.users, comments.c.user_id == tables.users.c.id)
+        .where(tables.comment_subs.c.user_id != comments.c.user_id)
+        .where(tables.devices.c.active == True))
+
+def _insert_notifications(notifications: Select) -> Insert:
+    return (
+        insert(tables.push_outbox)
+        .from_select(notifications.selected_columns.keys(), notifications)
+        .returning(tables.push_outbox))
+
+def push_notify_unread_comments(conn: Connection, comment: domain.Comment) -> list[domain.PushOutbox]:
+    """Queue a push notification for the devices of everyone subscribed to the comment's goal, 
+    except the comment author. The notifications are sent by src.push_worker."""
+    notifications = _select_notifications(tables.comments).where(tables.comments.c.id == comment.id)
+    inserted = conn.execute(_insert_notifications(notifications)).all()
+    notifs = [utils.from_row(domain.PushOutbox, row) for row in inserted]
+    return notifs
 
-    notifs = []
-    for row in result:
-        message = f"{row.commenter} commented on your goal: {row.comment[:50]}"
-        notif = domain.PushNotification(**row._mapping, message=message)
-        send_message(
-            notif.expo_push_token,
-            notif.message,
-        )
-        notifs.append(notif)
+def create_comment_and_notify(
+        conn: Connection, comment: domain.Comment) -> tuple[domain.Comment, list[domain.PushOutbox]]:
+    """Create a comment, count it, subscribe its author to the goal and queue the push notifications 
+    of the other subscribers, in one statement. Does what create_comment, push_notify_unread_comments 
+    and create_comment_sub do in one round trip instead of four."""
+    # stamped when the statement runs rather than when the transaction began, which is when it commits 
+    # on the route's autocommit connection, see _is_after_read_watermark
+    new_comment = (
+        insert(tables.comments)
+        .values(**comment.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True), created_at=func.clock_timestamp())
+        .returning(tables.comments)
+        .cte("new_comment"))
+    comment_count = (
+        update(tables.goals)
+        .values(comment_count=tables.goals.c.comment_count + 1)
+        .where(tables.goals.c.id == comment.goal_id)
+        .cte("comment_count"))
+    author_sub = domain.CommentSub(goal_id=comment.goal_id, user_id=comment.user_id)
+    comment_sub = (
+        pg_insert(tables.comment_subs)
+        .values(**author_sub.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True))
+        .on_conflict_do_nothing(constraint='uq_user_goal')
+        .cte("comment_sub"))
+    # the parts of a statement don't see each other's rows, so notify from new_comment, not from comments
+    notifications = _insert_notifications(_select_notifications(new_comment)).cte("notifications")
+    stmt = (
+        select(*utils.prefix(new_comment, "c_"), *utils.prefix(notifications, "p_"))
+        .select_from(new_comment)
+        .outerjoin(notifications, true())
+        .add_cte(comment_count, comment_sub))
 
-    return notifs
+    result = conn.execute(stmt)
+    comment_columns, notif_columns = (utils.columns_by_prefix(result.keys(), p) for p in ("c_", "p_"))
+    rows = result.all()
+    notifs = [utils.from_row(domain.PushOutbox, utils.pick(row, notif_columns)) for row in rows if row.p_id is not None]
+    return utils.from_row(domain.Comment, utils.pick(rows[0], comment_columns)), notifs
 
 
 ### DEVICES
 
 def create_device(conn: Connection, device: domain.Device) -> domain.Device:
+    """Register a device, or refresh it if its push token is already registered, 
+    e.g. after an app update or when another user signs in on it"""
+    stmt = pg_insert(tables.devices).values(**device.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True))
     stmt = (
-        insert(tables.devices)
-        .values(**device.model_dump(exclude=EXCLUDED_FIELDS, exclude_none=True))
+        stmt.on_conflict_do_update(
+            constraint='uq_expo_push_token',
+            set_={"user_id": stmt.excluded.user_id,
+                  "os": stmt.excluded.os,
+                  "version": stmt.excluded.version,
+                  "active": stmt.excluded.active,
+                  "updated_at": func.now()})
         .returning(tables.devices))
     inserted = conn.execute(stmt).fetchone()
-    return domain.Device(**inserted._mapping)
+    return utils.from_row(domain.Device, inserted)
+
+
+def deactivate_devices(conn: Connection, expo_push_tokens: list[str]) -> None:
+    """Stop notifying devices whose app was uninstalled"""
+    stmt = (
+        update(tables.devices)
+        .values(active=False)
+        .where(tables.devices.c.expo_push_token.in_(expo_push_tokens))
+        .where(tables.devices.c.active == True))
+    conn.execute(stmt)
 
 
 def read_devices(conn: Connection, user_ids: list[UUID]) -> list[domain.Device]:
     stmt = select(tables.devices).where(tables.devices.c.user_id.in_(user_ids))
     result = conn.execute(stmt).all()
-    devices = [domain.Device(**row._mapping) for row in result]
+    devices = [utils.from_row(domain.Device, row) for row in result]
     return devices
+
+
+### PUSH OUTBOX
+
+def claim_push_notifications(
+        conn: Connection, 
+        limit: int, 
+        lease: timedelta, 
+        window: timedelta = timedelta(0)) -> list[domain.PushOutbox]:
+    """Claim the pending notifications that are due, oldest first. A claim hides the notifications 
+    from other workers for the lease, so they are retried if this worker dies before recording the result.
+    
+    Notifications to a user about a goal are only claimed once the oldest of them that is due has waited 
+    for the window, so the notifications arriving in the meantime can be sent together. Notifications 
+    in backoff or deferred don't count until they are due, so they don't cut the window of new ones short."""
+    outbox = tables.push_outbox
+    waiting = outbox.alias('waiting')
+    window_passed = (
+        select(waiting.c.id)
+        .where(waiting.c.status == domain.PushStatus.PENDING)
+        .where(waiting.c.recipient_id == outbox.c.recipient_id)
+        .where(waiting.c.goal_id.is_not_distinct_from(outbox.c.goal_id))
+        .where(waiting.c.next_attempt_at <= func.now())
+        .where(waiting.c.created_at <= func.now() - window)
+        .exists())
+    due = (
+        select(outbox.c.id)
+        .where(outbox.c.status == domain.PushStatus.PENDING)
+        .where(outbox.c.next_attempt_at <= func.now())
+        .where(window_passed)
+        .order_by(outbox.c.next_attempt_at, outbox.c.created_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True))
+    stmt = (
+        update(tables.push_outbox)
+        .values(attempts=tables.push_outbox.c.attempts + 1,
+                next_attempt_at=func.now() + lease)
+        .where(tables.push_outbox.c.id.in_(due.scalar_subquery()))
+        .returning(tables.push_outbox))
+    claimed = conn.execute(stmt).all()
+    notifs = [utils.from_row(domain.PushOutbox, row) for row in claimed]
+    return notifs
+
+
+def update_push_notifications_sent(conn: Connection, ticket_ids: dict[UUID, str]) -> None:
+    """Mark notifications as sent, storing the Expo ticket id of each notification to check its receipt later"""
+    stmt = (
+        update(tables.push_outbox)
+        .values(status=domain.PushStatus.SENT, 
+                sent_at=func.now(), 
+                last_error=None, 
+                ticket_id=bindparam("b_ticket_id"))
+        .where(tables.push_outbox.c.id == bindparam("b_id")))
+    conn.execute(stmt, [{"b_id": id, "b_ticket_id": ticket_id} for id, ticket_id in ticket_ids.items()])
+
+
+def update_push_notifications_coalesced(conn: Connection, notif_ids: list[UUID], ticket_id: str) -> None:
+    """Mark notifications that were sent as part of another notification's summary message"""
+    stmt = (
+        update(tables.push_outbox)
+        .values(status=domain.PushStatus.COALESCED, sent_at=func.now(), last_error=None, ticket_id=ticket_id)
+        .where(tables.push_outbox.c.id.in_(notif_ids)))
+    conn.execute(stmt)
+
+
+def update_push_notifications_deferred(conn: Connection, notif_ids: list[UUID], delay: timedelta) -> None:
+    """Put claimed notifications back without counting the attempt, e.g. when the recipient was rate limited"""
+    stmt = (
+        update(tables.push_outbox)
+        .values(attempts=tables.push_outbox.c.attempts - 1, next_attempt_at=func.now() + delay)
+        .where(tables.push_outbox.c.id.in_(notif_ids)))
+    conn.execute(stmt)
+
+
+def read_push_counts(conn: Connection, recipient_ids: list[UUID], since: timedelta) -> dict[UUID, int]:
+    """Count the pushes sent to each user in the last `since`. A comment pushed to several devices 
+    of a user counts once."""
+    outbox = tables.push_outbox
+    stmt = (
+        select(outbox.c.recipient_id, func.count(func.coalesce(outbox.c.comment_id, outbox.c.id).distinct()).label("count"))
+        .where(outbox.c.recipient_id.in_(recipient_ids))
+        .where(outbox.c.status == domain.PushStatus.SENT)
+        .where(outbox.c.sent_at > func.now() - since)
+        .group_by(outbox.c.recipient_id))
+    result = conn.execute(stmt).all()
+    counts = defaultdict(int, {row.recipient_id: row.count for row in result})
+    return counts
+
+
+def update_push_notification_failed(conn: Connection, notif_id: UUID, error: str, retry_in: timedelta | None) -> None:
+    """Record a failed attempt, and schedule a retry unless retry_in is None"""
+    if retry_in is None:
+        values = dict(status=domain.PushStatus.FAILED)
+    else:
+        values = dict(next_attempt_at=func.now() + retry_in)
+    stmt = (
+        update(tables.push_outbox)
+        .values(last_error=error, **values)
+        .where(tables.push_outbox.c.id == notif_id))
+    conn.execute(stmt)
+
+
+def claim_push_receipts(conn: Connection, limit: int, sent_before: timedelta) -> list[domain.PushOutbox]:
+    """Claim sent notifications whose receipts have not been checked yet. 
+    Expo makes receipts available some time after sending, so only notifications sent more than sent_before ago are claimed."""
+    unchecked = (
+        select(tables.push_outbox.c.id)
+        .where(tables.push_outbox.c.status == domain.PushStatus.SENT)
+        .where(tables.push_outbox.c.ticket_id != None)
+        .where(tables.push_outbox.c.receipt_checked_at == None)
+        .where(tables.push_outbox.c.sent_at <= func.now() - sent_before)
+        .order_by(tables.push_outbox.c.sent_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True))
+    stmt = (
+        update(tables.push_outbox)
+        .values(receipt_checked_at=func.now())
+        .where(tables.push_outbox.c.id.in_(unchecked.scalar_subquery()))
+        .returning(tables.push_outbox))
+    claimed = conn.execute(stmt).all()
+    notifs = [utils.from_row(domain.PushOutbox, row) for row in claimed]
+    return notifs
+
+
+def update_push_receipts_unchecked(conn: Connection, notif_ids: list[UUID]) -> None:
+    """Release claimed receipts, e.g. when Expo could not be reached, so they are checked again"""
+    stmt = (
+        update(tables.push_outbox)
+        .values(receipt_checked_at=None)
+        .where(tables.push_outbox.c.id.in_(notif_ids)))
+    conn.execute(stmt)
@@ -1,17 +1,29 @@
+from contextlib import asynccontextmanager
 import logging
 import structlog
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from src.responses import ORJSONResponse
 from src.routes import common, v0
+from src.sqlalchemy.connection import async_engine, read_from_primary, replica_engine
+from src.sqlalchemy.utils import InvalidCursor
 
 log = structlog.get_logger()
 log.info("this is a test", key="value!")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # pooled asyncpg connections belong to this worker's event loop
+    await async_engine.dispose()
+    await replica_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.include_router(common.router)
 app.include_router(v0.router)
@@ -24,19 +36,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all HTTP methods
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Next-Cursor"],  # Pagination cursor of list endpoints
 )
 
+# clients read from the primary for this long after a write, longer than the replication lag
+READ_YOUR_WRITES_SECONDS = 10
+READ_YOUR_WRITES_COOKIE = "stacks-read-primary"
+
+
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next) -> Response:
+    """Send the reads of a client that just wrote to the primary, so it sees its own writes. 
+    The cookie expires on its own. Failed requests wrote nothing, so they don't set it."""
+    if request.method in ("GET", "HEAD", "OPTIONS"):
+        read_from_primary.set(READ_YOUR_WRITES_COOKIE in request.cookies)
+        return await call_next(request)
+    response = await call_next(request)
+    if response.status_code < 400:
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, "1", max_age=READ_YOUR_WRITES_SECONDS, httponly=True)
+    return response
+
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     log.error("Validation error", error=exc.errors(), request_method=request.method, request_url=request.url)
     
-    body = await request.json()
-
-    log.error("Request body", content=body)
+    # GET requests, e.g. with an out of range limit, have no body
+    body = await request.body()
+    if body:
+        log.error("Request body", content=body.decode(errors="replace"))
 
     return JSONResponse(
         status_code=422,
         content={"detail": exc.errors()},
     )
 
+
+@app.exception_handler(InvalidCursor)
+async def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    log.error("Invalid cursor", error=str(exc), request_method=request.method, request_url=request.url)
+    return JSONResponse(
+        status_code=400,
+        content={"detail": str(exc)},
+    )
@@ -1,11 +1,12 @@
 from exponent_server_sdk import (
-    DeviceNotRegisteredError,
     PushClient,
     PushMessage,
     PushServerError,
+    PushTicket,
     PushTicketError,
 )
 import os
+from typing import NamedTuple
 import requests
 from requests.exceptions import ConnectionError, HTTPError
 import structlog
@@ -30,35 +31,66 @@ session.headers.update(
     }
 )
 
-# Basic arguments. You should extend this function with the push features you
-# want to use, or simply pass in a `PushMessage` object.
-def send_message(device_token, message, extra=None):
-    try:
-        response = PushClient(session=session).publish(
-            PushMessage(to=device_token,
-                        body=message,
-                        data=extra))
-    except PushServerError as exc:
-        # Encountered some likely formatting/validation error.
-        log.error("PushServerError", exc=exc, token=device_token, message=message, extra=extra)
-        raise exc
-    except (ConnectionError, HTTPError) as exc:
-        # Encountered some Connection or HTTP error - retry a few times in
-        # case it is transient.
-        log.error("ConnectionError/HTTPError", exc=exc, token=device_token, message=message, extra=extra)
-        raise exc
+# Expo accepts up to 100 messages per request
+MAX_MESSAGES_PER_REQUEST = 100
 
-    try:
-        # We got a response back, but we don't know whether it's an error yet.
-        # This call raises errors so we can handle them with normal exception
-        # flows.
-        response.validate_response()
-    except DeviceNotRegisteredError:
-        # Mark the push token as inactive
-        # from notifications.models import PushToken
-        # PushToken.objects.filter(token=device_token).update(active=False)
-        log.error("DeviceNotRegisteredError", token=device_token, message=message, extra=extra)
-    except PushTicketError as exc:
-        # Encountered some other per-notification error.
-        log.error("PushTicketError", exc=exc, token=device_token, message=message, extra=extra, push_response=exc.push_response._asdict())
-        raise exc
+client = PushClient(session=session)
+
+
+class PushResult(NamedTuple):
+    """The outcome of sending one message: a ticket if Expo accepted it, an error if it did not"""
+    message: PushMessage
+    ticket: PushTicket | None = None
+    error: Exception | None = None
+
+
+def send_messages(messages: list[PushMessage]) -> list[PushResult]:
+    """Send the messages in chunks of MAX_MESSAGES_PER_REQUEST over the shared session.
+    Returns one result per message, in the same order. Errors are reported per message, not raised."""
+    results = []
+    for start in range(0, len(messages), MAX_MESSAGES_PER_REQUEST):
+        chunk = messages[start:start + MAX_MESSAGES_PER_REQUEST]
+        try:
+            tickets = client.publish_multiple(chunk)
+        except PushServerError as exc:
+            # Encountered some likely formatting/validation error, the whole chunk was rejected.
+            log.error("PushServerError", exc=exc, count=len(chunk))
+            results += [PushResult(message, error=exc) for message in chunk]
+            continue
+        except (ConnectionError, HTTPError) as exc:
+            # Encountered some Connection or HTTP error, the caller can retry the chunk.
+            log.error("ConnectionError/HTTPError", exc=exc, count=len(chunk))
+            results += [PushResult(message, error=exc) for message in chunk]
+            continue
+
+        for message, ticket in zip(chunk, tickets):
+            try:
+                # We got a response back, but we don't know whether it's an error yet.
+                # This call raises errors so we can handle them with normal exception
+                # flows.
+                ticket.validate_response()
+                results.append(PushResult(message, ticket=ticket))
+            except PushTicketError as exc:
+                # Encountered a per-notification error, e.g. DeviceNotRegisteredError.
+                log.error(type(exc).__name__, token=message.to, push_response=ticket._asdict())
+                results.append(PushResult(message, ticket=ticket, error=exc))
+
+    return results
+
+
+def check_receipts(ticket_ids: list[str]) -> dict[str, Exception | None]:
+    """Check the delivery receipts of sent messages. Returns the error, or None on success, of each 
+    ticket with a receipt. Tickets without one yet are left out. Raises if the request itself fails."""
+    # the client only needs the ids of the tickets
+    tickets = [PushTicket(None, PushTicket.SUCCESS_STATUS, "", None, id) for id in ticket_ids]
+    receipts = client.check_receipts_multiple(tickets)
+
+    errors = {}
+    for receipt in receipts:
+        try:
+            receipt.validate_response()
+            errors[receipt.id] = None
+        except PushTicketError as exc:
+            log.error(type(exc).__name__, ticket_id=receipt.id, push_response=receipt._asdict())
+            errors[receipt.id] = exc
+    return errors
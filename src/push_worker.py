@@ -0,0 +1,184 @@
+"""Send the push notifications queued in the push_outbox table, and check their delivery receipts.
+
+Run it next to the api with `python -m src.push_worker`.
+"""
+from collections import defaultdict
+from datetime import timedelta
+import time
+
+from exponent_server_sdk import DeviceNotRegisteredError, PushMessage, PushServerError
+from requests.exceptions import ConnectionError, HTTPError
+import structlog
+
+from src import api, push_notifications
+from src.types import domain
+from src.sqlalchemy.connection import engine
+
+log = structlog.get_logger()
+
+# sent to Expo in chunks of push_notifications.MAX_MESSAGES_PER_REQUEST
+BATCH_SIZE = 500
+# claimed notifications are retried after the lease if the worker dies mid batch
+LEASE = timedelta(minutes=5)
+MAX_ATTEMPTS = 5
+# retries back off exponentially: 30s, 1m, 2m, 4m
+BACKOFF = timedelta(seconds=30)
+POLL_INTERVAL_SECONDS = 1
+# notifications to a user about the same goal within the window are sent as one summary
+COALESCE_WINDOW = timedelta(seconds=30)
+# pushes to a user beyond the cap are deferred, to be coalesced with whatever arrives in the meantime
+MAX_PUSHES_PER_MINUTE = 6
+
+# Expo recommends waiting 15 minutes before checking receipts, and keeps them for a day
+RECEIPT_DELAY = timedelta(minutes=15)
+RECEIPT_BATCH_SIZE = 1000
+RECEIPT_INTERVAL_SECONDS = 60
+
+
+def retry_in(attempts: int) -> timedelta | None:
+    """The delay before the next attempt, or None if the notification should not be retried"""
+    if attempts >= MAX_ATTEMPTS:
+        return None
+    return BACKOFF * 2 ** (attempts - 1)
+
+
+def coalesce(notifs: list[domain.PushOutbox]) -> list[list[domain.PushOutbox]]:
+    """Group the notifications to a user about the same goal, oldest first within each group"""
+    groups = defaultdict(list)
+    for notif in sorted(notifs, key=lambda n: n.created_at):
+        groups[(notif.recipient_id, notif.goal_id)].append(notif)
+    return list(groups.values())
+
+
+def by_device(group: list[domain.PushOutbox]) -> list[list[domain.PushOutbox]]:
+    """Split a group into the notifications of each of the user's devices, which each get one push"""
+    devices = defaultdict(list)
+    for notif in group:
+        devices[notif.expo_push_token].append(notif)
+    return list(devices.values())
+
+
+def summarize(group: list[domain.PushOutbox], authors: dict) -> str:
+    """The message for a group of notifications, e.g. '3 new comments from bob, alice and others'"""
+    if len(group) == 1:
+        return group[0].message
+    names = []
+    for notif in reversed(group):
+        name = authors.get(notif.comment_id)
+        if name and name not in names:
+            names.append(name)
+    message = f"{len(group)} new comments on your goal"
+    if names:
+        message = f"{len(group)} new comments from {', '.join(names[:2])}"
+        if len(names) > 2:
+            message += " and others"
+    return message
+
+
+def drain(batch_size: int = BATCH_SIZE) -> int:
+    """Send one batch of due notifications. Returns the number of notifications attempted."""
+    # claim and record in short transactions, so no connection is held while waiting on Expo
+    with engine.begin() as conn:
+        notifs = api.claim_push_notifications(conn, batch_size, LEASE, COALESCE_WINDOW)
+        if not notifs:
+            return 0
+        groups = coalesce(notifs)
+        authors = api.read_comment_authors(conn, [n.comment_id for n in notifs if n.comment_id])
+        push_counts = api.read_push_counts(conn, list({n.recipient_id for n in notifs}), timedelta(minutes=1))
+
+    to_send, deferred = [], []
+    for group in groups:
+        recipient_id = group[0].recipient_id
+        if push_counts[recipient_id] >= MAX_PUSHES_PER_MINUTE:
+            deferred.extend(n.id for n in group)
+        else:
+            push_counts[recipient_id] += 1
+            to_send.extend(by_device(group))
+
+    messages = [PushMessage(to=device[0].expo_push_token, body=summarize(device, authors)) for device in to_send]
+    results = push_notifications.send_messages(messages)
+
+    sent, coalesced, failed, dead_tokens = {}, [], [], []
+    for device, result in zip(to_send, results):
+        # the newest notification carries the ticket, the rest are marked as coalesced into it
+        *rest, lead = device
+        if result.error is None:
+            sent[lead.id] = result.ticket.id
+            coalesced.append(([n.id for n in rest], result.ticket.id))
+        elif isinstance(result.error, DeviceNotRegisteredError):
+            # retrying will not help, the app was uninstalled
+            failed.extend((n, repr(result.error), None) for n in device)
+            dead_tokens.append(lead.expo_push_token)
+        else:
+            failed.extend((n, repr(result.error), retry_in(n.attempts)) for n in device)
+
+    with engine.begin() as conn:
+        if sent:
+            api.update_push_notifications_sent(conn, sent)
+        for notif_ids, ticket_id in coalesced:
+            if notif_ids:
+                api.update_push_notifications_coalesced(conn, notif_ids, ticket_id)
+        if deferred:
+            api.update_push_notifications_deferred(conn, deferred, timedelta(minutes=1))
+        for notif, error, retry in failed:
+            api.update_push_notification_failed(conn, notif.id, error, retry)
+        if dead_tokens:
+            api.deactivate_devices(conn, dead_tokens)
+
+    log.info(
+        "Drained push outbox", 
+        sent=len(sent), 
+        coalesced=sum(len(ids) for ids, _ in coalesced), 
+        deferred=len(deferred), 
+        failed=len(failed), 
+        deactivated=len(dead_tokens))
+    return len(notifs)
+
+
+def check_receipts(batch_size: int = RECEIPT_BATCH_SIZE) -> int:
+    """Check the receipts of one batch of sent notifications, and deactivate the devices that are 
+    no longer registered. Returns the number of receipts checked."""
+    with engine.begin() as conn:
+        notifs = api.claim_push_receipts(conn, batch_size, RECEIPT_DELAY)
+    if not notifs:
+        return 0
+
+    try:
+        errors = push_notifications.check_receipts([n.ticket_id for n in notifs])
+    except (PushServerError, ConnectionError, HTTPError) as exc:
+        log.error("Checking push receipts failed", exc=exc, count=len(notifs))
+        with engine.begin() as conn:
+            api.update_push_receipts_unchecked(conn, [n.id for n in notifs])
+        return 0
+
+    failed = [(n, errors[n.ticket_id]) for n in notifs if errors.get(n.ticket_id) is not None]
+    dead_tokens = [n.expo_push_token for n, error in failed if isinstance(error, DeviceNotRegisteredError)]
+    with engine.begin() as conn:
+        for notif, error in failed:
+            api.update_push_notification_failed(conn, notif.id, repr(error), None)
+        if dead_tokens:
+            api.deactivate_devices(conn, dead_tokens)
+
+    log.info("Checked push receipts", checked=len(notifs), failed=len(failed), deactivated=len(dead_tokens))
+    return len(notifs)
+
+
+def main() -> None:
+    log.info("Starting push worker", batch_size=BATCH_SIZE)
+    receipts_checked_at = 0
+    while True:
+        try:
+            if time.monotonic() - receipts_checked_at >= RECEIPT_INTERVAL_SECONDS:
+                while check_receipts() == RECEIPT_BATCH_SIZE:
+                    pass
+                receipts_checked_at = time.monotonic()
+            if drain() < BATCH_SIZE:
+                time.sleep(POLL_INTERVAL_SECONDS)
+        except Exception:
+            # e.g. the db restarting. Notifications claimed before the error are retried after their lease.
+            log.exception("Push worker iteration failed")
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+from typing import Any
+from uuid import UUID
+
+import orjson
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+
+def _default(obj: Any) -> Any:
+    # pydantic's own dump, so field serializers, aliases and exclusions apply as on the response_model path,
+    # and models built with model_construct come out in field order rather than row order
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(by_alias=True)
+    # asyncpg returns a subclass of UUID, which orjson does not serialize natively
+    if isinstance(obj, UUID):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class ORJSONResponse(JSONResponse):
+    """JSON response encoded with orjson, which serializes UUIDs, datetimes and pydantic models natively.
+    The output matches pydantic's: compact, with UTC datetimes ending in Z."""
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
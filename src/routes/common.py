@@ -1,4 +1,5 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 router = APIRouter()
 
@@ -7,3 +8,9 @@ router = APIRouter()
 @router.get("/healthcheck")
 async def healthcheck():
     return {"status": "ok"}
+
+
+@router.get("/metrics")
+async def metrics():
+    """Prometheus metrics, e.g. of the db connection pools"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -3,12 +3,15 @@ import structlog
 from uuid import UUID
 
 from fastapi.responses import JSONResponse
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Response
 from pydantic import EmailStr
 
 from src.types import requests, domain
 from src import api
-from src.sqlalchemy.connection import engine
+from src.responses import ORJSONResponse
+from src.sqlalchemy import utils
+from src.sqlalchemy.connection import begin_pipelined, begin_read_only, connect_read, connect_write
+from src.config import get_config
 
 log = structlog.get_logger()
 
@@ -17,213 +20,313 @@ router = APIRouter(
     tags=["v0"]
 )
 
+Limit = Annotated[int, Query(ge=1, le=utils.MAX_PAGE_SIZE)]
+
+# render the heavy list responses in the db, see utils.paginate_json
+RENDER_JSON_IN_DB = get_config().get("render_json_in_db", False)
+
+
+def set_next_cursor(response: Response, items: list, limit: int) -> None:
+    """Pass the cursor of the next page in a header, so list responses stay plain lists"""
+    cursor = utils.next_cursor(items, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+
+def trusted_response(items: list, limit: int | None = None) -> ORJSONResponse:
+    """Return models built from db rows as is, skipping the re-validation against the response_model, 
+    which still documents the schema. Pass the limit of paginated lists to set their next cursor."""
+    response = ORJSONResponse(items)
+    if limit is not None:
+        set_next_cursor(response, items, limit)
+    return response
+
+
+def json_page_response(page: utils.JsonPage) -> Response:
+    """Return the JSON rendered by the db as is, skipping pydantic validation and serialization"""
+    response = Response(content=page.json, media_type="application/json")
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return response
+
 ### USER
 
 @router.post("/users")
-def post_user(user: requests.NewUser) -> domain.User:
+async def post_user(user: requests.NewUser) -> domain.User:
     log.debug("Creating user", user=user)
-    with engine.begin() as conn:
-        s_user = api.create_user(conn, domain.User(**user.model_dump()))
+    async with connect_write() as conn:
+        s_user = await conn.run_sync(api.create_user, domain.User(**user.model_dump()))
     return s_user
 
 
 @router.get("/users/{user_id}")
-def get_user(user_id: UUID) -> domain.User:
-    with engine.begin() as conn:
-        user = api.read_user(conn, id=user_id)
+async def get_user(user_id: UUID) -> domain.User:
+    async with connect_read() as conn:
+        user = await conn.run_sync(api.read_user, id=user_id)
     return user
 
 
 @router.get("/users")
-def get_user(email: EmailStr | None = None, username: str | None = None) -> list[domain.User]:
-    with engine.begin() as conn:
+async def get_user(email: EmailStr | None = None, username: str | None = None) -> list[domain.User]:
+    async with connect_read() as conn:
         assert len(username) >= 3
-        user = api.read_user(conn, email=email, username=username)
+        user = await conn.run_sync(api.read_user, email=email, username=username)
     if user is None:
         return JSONResponse({"error": "User not found"}, status_code=404)
     return [user]
 
 
 @router.get("/users/search/{user_id}")
-def get_search_users(user_id: UUID) -> list[domain.UserEnriched]:
-    with engine.begin() as conn:
-        users = api.search_users(conn, user_id)
+async def get_search_users(
+        user_id: UUID,
+        q: str = "",
+        limit: Limit = utils.PAGE_SIZE,
+        cursor: str | None = None) -> list[domain.UserEnriched]:
+    async with connect_read() as conn:
+        users = await conn.run_sync(api.search_users, user_id, q=q, limit=limit, cursor=cursor)
     log.debug("Users", users=users)
-    return users
+    response = trusted_response(users)
+    next_cursor = utils.next_search_cursor(users, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
 
 @router.delete("/users/{user_id}")
-def delete_user(user_id: UUID):
-    with engine.begin() as conn:
-        api.delete_user(conn, user_id)
+async def delete_user(user_id: UUID):
+    async with begin_pipelined() as conn:
+        await conn.run_sync(api.delete_user, user_id)
 
 
 @router.get("/users/leaders/{user_id}")
-def get_leaders(user_id: UUID) -> list[domain.UserEnriched]:
+async def get_leaders(
+        user_id: UUID,
+        limit: Limit = utils.PAGE_SIZE,
+        cursor: str | None = None) -> list[domain.UserEnriched]:
     log.debug("Getting leaders for user", user_id=user_id)
-    with engine.begin() as conn:
-        leaders = api.read_leaders(conn, user_id)
+    async with connect_read() as conn:
+        leaders = await conn.run_sync(api.read_leaders, user_id, limit=limit, cursor=cursor)
     log.debug("Leaders", leaders=leaders)
-    return leaders
+    return trusted_response(leaders, limit)
 
 
 @router.get("/users/followers/{user_id}")
-def get_followers(user_id: UUID) -> list[domain.UserEnriched]:
+async def get_followers(
+        user_id: UUID,
+        limit: Limit = utils.PAGE_SIZE,
+        cursor: str | None = None) -> list[domain.UserEnriched]:
     log.debug("Getting followers for user", user_id=user_id)
-    with engine.begin() as conn:
-        followers = api.read_followers(conn, user_id)
+    if RENDER_JSON_IN_DB:
+        async with connect_read() as conn:
+            page = await conn.run_sync(api.read_followers_json, user_id, limit=limit, cursor=cursor)
+        return json_page_response(page)
+    async with connect_read() as conn:
+        followers = await conn.run_sync(api.read_followers, user_id, limit=limit, cursor=cursor)
     log.debug("Followers", followers=followers)
-    return followers
+    return trusted_response(followers, limit)
 
 ### FOLLOW
 
 @router.post("/follows")
-def post_follow(follow: requests.NewFollow) -> domain.Follow:
+async def post_follow(follow: requests.NewFollow) -> domain.Follow:
     log.debug("Creating follow", follow=follow)
-    with engine.begin() as conn:
-        s_follow = api.create_follow(conn, domain.Follow(**follow.model_dump()))
+    async with begin_pipelined() as conn:
+        s_follow = await conn.run_sync(api.create_follow, domain.Follow(**follow.model_dump()))
     return s_follow
 
 
 @router.delete("/follows/{follower_id}/leaders/{leader_id}")
-def delete_follow(follower_id: UUID, leader_id: UUID):
+async def delete_follow(follower_id: UUID, leader_id: UUID):
     log.debug("Deleting follow", follower_id=follower_id, leader_id=leader_id)
-    with engine.begin() as conn:
-        api.delete_follow(conn, domain.Follow(follower_id=follower_id, leader_id=leader_id))
+    async with begin_pipelined() as conn:
+        await conn.run_sync(api.delete_follow, domain.Follow(follower_id=follower_id, leader_id=leader_id))
 
 
 @router.get("/follows/counts/{user_id}")
-def get_follow_counts(user_id: UUID) -> domain.FollowCounts:
+async def get_follow_counts(user_id: UUID) -> domain.FollowCounts:
     log.debug("Getting follow counts for user", user_id=user_id)
-    with engine.begin() as conn:
-        counts = api.read_follow_counts(conn, user_id)
+    async with connect_read() as conn:
+        counts = await conn.run_sync(api.read_follow_counts, user_id)
     log.debug("Follow counts", counts=counts)
     return counts
 
 ### GOAL
 
 @router.post("/goals")
-def post_goal(goal: requests.NewGoal) -> domain.Goal:
+async def post_goal(goal: requests.NewGoal) -> domain.Goal:
     log.debug("Creating goal", goal=goal)
-    with engine.begin() as conn:
-        s_goal = api.create_goal(conn, domain.Goal(**goal.model_dump()))
-        api.create_comment_sub(conn, domain.CommentSub(goal_id=s_goal.id, user_id=s_goal.user_id))
+    async with connect_write() as conn:
+        s_goal = await conn.run_sync(api.create_goal, domain.Goal(**goal.model_dump()))
     return s_goal
 
 
+@router.post("/goals/milestones")
+async def post_goal_with_milestones(goal: requests.NewGoalWithMilestones) -> list[domain.Goal]:
+    log.debug("Creating goal with milestones", goal=goal)
+    async with connect_write() as conn:
+        s_goals = await conn.run_sync(
+            api.create_goal_with_milestones, domain.Goal(**goal.model_dump(exclude={"milestones"})), goal.milestones)
+    return s_goals
+
+
 @router.get("/goals")
-def get_goals(user_id: UUID = None, goal_ids: Annotated[list[UUID], Query()] = None, parent_id: UUID = None) -> list[domain.GoalEnriched]:
+async def get_goals(
+        user_id: UUID = None,
+        goal_ids: Annotated[list[UUID], Query()] = None,
+        parent_id: UUID = None,
+        limit: Limit = utils.PAGE_SIZE,
+        cursor: str | None = None) -> list[domain.GoalEnriched]:
     log.debug("Getting goals", user_id=user_id, goal_ids=goal_ids, parent_id=parent_id)
-    with engine.begin() as conn:
-        goals = api.read_goals(conn, user_id=user_id, goal_ids=goal_ids, parent_id=parent_id)
+    if RENDER_JSON_IN_DB:
+        async with connect_read() as conn:
+            page = await conn.run_sync(
+                api.read_goals_json, user_id=user_id, goal_ids=goal_ids, parent_id=parent_id, limit=limit, cursor=cursor)
+        return json_page_response(page)
+    async with connect_read() as conn:
+        goals = await conn.run_sync(api.read_goals, user_id=user_id, goal_ids=goal_ids, parent_id=parent_id, limit=limit, cursor=cursor)
     # log.debug("Goals", goals=goals)
-    return goals
+    return trusted_response(goals, limit)
+
+
+@router.get("/goals/{goal_id}/tree")
+async def get_goal_tree(
+        goal_id: UUID,
+        max_depth: Annotated[int, Query(ge=0, le=api.MAX_TREE_DEPTH)] = api.MAX_TREE_DEPTH) -> domain.GoalTree:
+    log.debug("Getting goal tree", goal_id=goal_id, max_depth=max_depth)
+    async with connect_read() as conn:
+        tree = await conn.run_sync(api.read_goal_tree, goal_id, max_depth=max_depth)
+    if tree is None:
+        return JSONResponse({"error": "Goal not found"}, status_code=404)
+    return trusted_response(tree)
 
 
 @router.get("/goals/announcements/{user_id}")
-def get_announcements(user_id: UUID) -> list[domain.GoalEnriched]:
-    log.debug("Getting announcements for user", user_id=user_id)
-    with engine.begin() as conn:
-        announcements = api.read_announcements(conn, user_id)
+async def get_announcements(
+        user_id: UUID,
+        limit: Limit = utils.PAGE_SIZE,
+        cursor: str | None = None) -> list[domain.GoalEnriched]:
+    log.debug("Getting announcements for user", user_id=user_id, limit=limit)
+    if RENDER_JSON_IN_DB:
+        async with connect_read() as conn:
+            page = await conn.run_sync(api.read_announcements_json, user_id, limit=limit, cursor=cursor)
+        return json_page_response(page)
+    async with connect_read() as conn:
+        announcements = await conn.run_sync(api.read_announcements, user_id, limit=limit, cursor=cursor)
     # log.debug("Announcements", announcements=announcements)
-    return announcements
+    return trusted_response(announcements, limit)
+
+
+@router.get("/feed/{user_id}")
+async def get_feed(
+        user_id: UUID,
+        limit: Limit = utils.PAGE_SIZE,
+        cursor: str | None = None) -> list[domain.FeedItem]:
+    log.debug("Getting feed for user", user_id=user_id, limit=limit)
+    async with begin_read_only() as conn:
+        feed = await conn.run_sync(api.read_feed, user_id, limit=limit, cursor=cursor)
+    return trusted_response(feed, limit)
 
 
 @router.patch("/goals/{goal_id}")
-def patch_goal(goal_id: UUID, updates: requests.UpdateGoal) -> domain.Goal:
+async def patch_goal(goal_id: UUID, updates: requests.UpdateGoal) -> domain.Goal:
     log.debug("Updating goal", goal_id=goal_id, updates=updates)
-    with engine.begin() as conn:
-        goal = api.update_goal(conn, goal_id, updates)
+    async with connect_write() as conn:
+        goal = await conn.run_sync(api.update_goal, goal_id, updates)
     return goal
 
 
 @router.delete("/goals/{goal_id}")
-def delete_goal(goal_id: UUID):
-    with engine.begin() as conn:
-        api.delete_goal(conn, goal_id)
+async def delete_goal(goal_id: UUID):
+    async with connect_write() as conn:
+        await conn.run_sync(api.delete_goal, goal_id)
 
 ### REACTIONS
 
 @router.post("/reactions")
-def post_reaction(reaction: requests.NewReaction) -> domain.Reaction:
+async def post_reaction(reaction: requests.NewReaction) -> domain.Reaction:
     log.debug("Creating reaction", reaction=reaction)
-    with engine.begin() as conn:
-        s_reaction = api.create_reaction(conn, domain.Reaction(**reaction.model_dump()))
+    async with connect_write() as conn:
+        s_reaction = await conn.run_sync(api.create_reaction, domain.Reaction(**reaction.model_dump()))
     return s_reaction
 
 
 @router.get("/reactions")
-def get_reactions(goal_ids: Annotated[list[UUID], Query()] = None) -> dict[UUID, list[domain.Reaction]]:
+async def get_reactions(goal_ids: Annotated[list[UUID], Query()] = None) -> dict[UUID, list[domain.Reaction]]:
     log.debug("Getting reactions for goals", goal_ids=goal_ids)
-    with engine.begin() as conn:
-        reactions = api.read_reactions(conn, goal_ids=goal_ids)
+    async with connect_read() as conn:
+        reactions = await conn.run_sync(api.read_reactions, goal_ids=goal_ids)
     # log.debug("Reactions", reactions=reactions)
     return reactions
 
 ### COMMENTS
 
 @router.post("/comments")
-def post_comment(comment: requests.NewComment) -> domain.Comment:
+async def post_comment(comment: requests.NewComment) -> domain.Comment:
     log.debug("Creating comment", comment=comment)
-    with engine.begin() as conn:
-        s_comment = api.create_comment(conn, domain.Comment(**comment.model_dump()))
-        unread_comments = api.create_unread_comments(conn, s_comment)
-        notifs = api.push_notify_unread_comments(conn, unread_comments)
-        log.debug("Push Notifications", count=len(notifs), notifs=notifs)
-        # sub after creating the unreads because you don't want to notify the user of their own comment
-        api.create_comment_sub(conn, domain.CommentSub(goal_id=s_comment.goal_id, user_id=s_comment.user_id))
+    async with connect_write() as conn:
+        s_comment, notifs = await conn.run_sync(api.create_comment_and_notify, domain.Comment(**comment.model_dump()))
+    log.debug("Push Notifications", count=len(notifs), notifs=notifs)
     return s_comment
 
 
 @router.get("/comments")
-def get_comments(user_id: UUID | None = None, goal_id: UUID | None = None) -> list[domain.CommentEnriched]:    
+async def get_comments(
+        user_id: UUID | None = None,
+        goal_id: UUID | None = None,
+        limit: Limit = utils.PAGE_SIZE,
+        cursor: str | None = None) -> list[domain.CommentEnriched]:
     log.debug("Getting comments", user_id=user_id, goal_id=goal_id)
-    with engine.begin() as conn:
-        comments = api.read_comments(conn, user_id=user_id, goal_id=goal_id)
+    if RENDER_JSON_IN_DB:
+        async with connect_read() as conn:
+            page = await conn.run_sync(
+                api.read_comments_json, user_id=user_id, goal_id=goal_id, limit=limit, cursor=cursor)
+        return json_page_response(page)
+    async with connect_read() as conn:
+        comments = await conn.run_sync(api.read_comments, user_id=user_id, goal_id=goal_id, limit=limit, cursor=cursor)
     # log.debug("Comments", comments=comments)
-    return comments
+    return trusted_response(comments, limit)
 
 
 @router.get("/comments/count")
-def get_comment_counts(goal_ids: Annotated[list[UUID], Query()] = None) -> list[domain.CommentCount]:
+async def get_comment_counts(goal_ids: Annotated[list[UUID], Query()] = None) -> list[domain.CommentCount]:
     log.debug("Getting comment count for goals", goal_ids=goal_ids)
-    with engine.begin() as conn:
-        counts = api.read_comment_counts(conn, goal_ids)
+    async with connect_read() as conn:
+        counts = await conn.run_sync(api.read_comment_counts, goal_ids)
     return counts
 
 
 @router.get("/comments/unread/count/{user_id}")
-def get_unread_comment_count(user_id: UUID) -> int:
+async def get_unread_comment_count(user_id: UUID) -> int:
     log.debug("Getting unread comment count for user", user_id=user_id)
-    with engine.begin() as conn:
-        count = api.read_unread_comment_count(conn, user_id)
+    async with connect_read() as conn:
+        count = await conn.run_sync(api.read_unread_comment_count, user_id)
     log.debug("Unread comment count", count=count)
     return count
 
 
 @router.patch("/comments/unread")
-def patch_unread_comments(body: requests.UpdateUnreadComments) -> None:
+async def patch_unread_comments(body: requests.UpdateUnreadComments) -> None:
     user_id = body.user_id
     comment_ids = body.comment_ids
     log.debug("Updating unread comments", user_id=user_id, comment_ids=comment_ids)
-    with engine.begin() as conn:
-        api.update_unread_comments(conn, user_id, comment_ids)
+    async with connect_write() as conn:
+        await conn.run_sync(api.update_read_watermarks, user_id, comment_ids)
 
 
 @router.get("/comments/unread")
-def get_unread_comments(user_id: UUID) -> list[domain.CommentEnriched]:
+async def get_unread_comments(user_id: UUID) -> list[domain.CommentEnriched]:
     log.debug("Getting unread comments for user", user_id=user_id)
-    with engine.begin() as conn:
-        comments = api.read_unread_comments(conn, user_id)
+    async with connect_read() as conn:
+        comments = await conn.run_sync(api.read_unread_comments, user_id)
     log.debug("Unread comments", comments=comments)
-    return comments
+    return trusted_response(comments)
 
 
 ### DEVICES
 
 @router.post("/devices")
-def post_device(device: requests.NewDevice) -> domain.Device:
+async def post_device(device: requests.NewDevice) -> domain.Device:
     log.debug("Creating device", device=device)
-    with engine.begin() as conn:
-        s_device = api.create_device(conn, domain.Device(**device.model_dump()))
+    async with connect_write() as conn:
+        s_device = await conn.run_sync(api.create_device, domain.Device(**device.model_dump()))
     return s_device
\ No newline at end of file
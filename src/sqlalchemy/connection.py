@@ -1,9 +1,142 @@
-from sqlalchemy import create_engine
-from contextlib import contextmanager
+import os
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.engine import URL, Engine
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.util import await_only
 
 from src.config import get_config
+from src.sqlalchemy import metrics
 
 
-engine = create_engine(**get_config()["db"])
+def async_url(url: str) -> URL:
+    """The async equivalent of a db url. psycopg urls keep their driver, whose async mode 
+    supports pipelines, see begin_pipelined. Other drivers are replaced by asyncpg."""
+    url = make_url(url)
+    query = dict(url.query)
+    # pg8000 takes the path of the socket file, asyncpg and psycopg the directory it is in
+    if "unix_sock" in query:
+        query["host"] = os.path.dirname(query.pop("unix_sock"))
+    drivername = url.drivername if url.get_driver_name() == "psycopg" else "postgresql+asyncpg"
+    return url.set(drivername=drivername, query=query)
 
+
+def utc_connect_args(url: URL) -> dict:
+    """Start sessions in UTC. psycopg returns datetimes in the session TimeZone, where asyncpg returns them
+    in UTC, and the JSON rendered by the db is in UTC too, see utils.json_value. So the API serializes datetimes
+    the same whatever the driver and the db's default TimeZone. The PGTZ environment variable overrides this."""
+    driver = url.get_driver_name()
+    if driver == "asyncpg":
+        return {"server_settings": {"timezone": "UTC"}}
+    if driver in ("psycopg", "psycopg2"):
+        return {"options": "-c timezone=UTC"}
+    return {}
+
+
+def _sync_pipeline(conn, cursor, statement, parameters, context, executemany):
+    """SQLAlchemy reads the result of a statement as soon as it is sent, so in a pipeline wait on 
+    statements that may return rows. Inserts, updates and deletes without RETURNING don't wait."""
+    pipeline = conn.info.get("pipeline")
+    if pipeline is None:
+        return
+    if context.is_crud and not context.compiled.effective_returning:
+        return
+    from psycopg.pq import ExecStatus
+
+    await_only(pipeline.sync())
+    # SQLAlchemy's cursor adapter buffers the rows as the statement is sent, before a pipeline receives them, 
+    # and has no public way to buffer them later. So fill its private buffer, which is why requirements/prod.in 
+    # pins SQLAlchemy to 2.0, whose adapter keeps the rows in _rows and the psycopg cursor in _cursor.
+    if cursor.pgresult and cursor.pgresult.status == ExecStatus.TUPLES_OK:
+        cursor._rows.extend(await_only(cursor._cursor.fetchall()))
+
+
+def support_pipelines(engine: Engine) -> None:
+    event.listen(engine, "after_cursor_execute", _sync_pipeline)
+
+
+def create_async_engine_from_config(db: dict, name: str) -> AsyncEngine:
+    url = async_url(db["url"])
+    async_engine = create_async_engine(
+        **{**db, "url": url}, 
+        connect_args=utc_connect_args(url),
+        poolclass=metrics.TimedAsyncAdaptedQueuePool, 
+        pool_logging_name=name)
+    metrics.instrument(async_engine.sync_engine)
+    support_pipelines(async_engine.sync_engine)
+    return async_engine
+
+
+# for scripts, tests and the push worker
+engine = create_engine(
+    **get_config()["db"], 
+    connect_args=utc_connect_args(make_url(get_config()["db"]["url"])), 
+    poolclass=metrics.TimedQueuePool, 
+    pool_logging_name="sync")
+metrics.instrument(engine)
+
+# for the routes, so requests wait on the db without holding a thread. Writes go to the primary.
+# asyncpg, or psycopg if the db url uses it, see async_url
+async_engine = create_async_engine_from_config(get_config()["db"], "primary")
+
+# reads of GET routes go to the optional replica
+replica_engine = (
+    create_async_engine_from_config(get_config()["replica"], "replica") if "replica" in get_config() else async_engine)
+
+# set per request, for clients that wrote recently and must read their own writes despite replication lag
+read_from_primary: ContextVar[bool] = ContextVar("read_from_primary", default=False)
+
+
+def read_engine() -> AsyncEngine:
+    return async_engine if read_from_primary.get() else replica_engine
+
+
+@asynccontextmanager
+async def connect_read() -> AsyncIterator[AsyncConnection]:
+    """Connect to the replica, or to the primary for clients that wrote recently, in autocommit mode.
+    For reads of a single statement, which need no transaction, so they skip the BEGIN and COMMIT round trips."""
+    async with read_engine().connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        yield conn
+
+
+@asynccontextmanager
+async def connect_write() -> AsyncIterator[AsyncConnection]:
+    """Connect to the primary in autocommit mode, for writes of a single statement, which is atomic on its own"""
+    async with async_engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        yield conn
+
+
+@asynccontextmanager
+async def begin_read_only() -> AsyncIterator[AsyncConnection]:
+    """Begin a read only transaction, so reads spanning several statements see one snapshot.
+    asyncpg and psycopg send BEGIN READ ONLY, which saves the round trip of a separate SET TRANSACTION READ ONLY."""
+    async with read_engine().connect() as conn:
+        await conn.execution_options(postgresql_readonly=True)
+        async with conn.begin():
+            yield conn
+
+
+@asynccontextmanager
+async def begin_pipelined() -> AsyncIterator[AsyncConnection]:
+    """Begin a transaction on the primary, in pipeline mode if the driver is psycopg. Statements are sent
+    without waiting on the ones before, so writes of several statements take fewer round trips.
+    Statements that don't wait have no rowcount, so don't pipeline writes that check it."""
+    async with async_engine.connect() as conn:
+        if async_engine.dialect.driver != "psycopg":
+            async with conn.begin():
+                yield conn
+            return
+        driver_connection = (await conn.get_raw_connection()).driver_connection
+        # the COMMIT is sent with the statements that did not wait
+        async with driver_connection.pipeline() as pipeline:
+            conn.sync_connection.info["pipeline"] = pipeline
+            try:
+                async with conn.begin():
+                    yield conn
+            finally:
+                del conn.sync_connection.info["pipeline"]
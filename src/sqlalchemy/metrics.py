@@ -0,0 +1,72 @@
+"""Prometheus metrics of the connection pools, served at /metrics. 
+
+Each pool is labeled with its pool_logging_name. The metrics are per process, so with several 
+gunicorn workers each scrape sees one worker.
+"""
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+CONNECTS = Counter("db_pool_connects_total", "New connections opened by the pool", ["pool"])
+CHECKOUTS = Counter("db_pool_checkouts_total", "Connections checked out of the pool", ["pool"])
+INVALIDATIONS = Counter("db_pool_invalidations_total", "Connections invalidated, e.g. after a disconnect", ["pool"])
+CHECKOUT_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time waiting for a connection, including opening a new one", ["pool"],
+    buckets=(.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+HELD = Histogram(
+    "db_pool_held_seconds", "Time a connection was checked out", ["pool"],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+SIZE = Gauge("db_pool_size", "Connections the pool keeps open", ["pool"])
+CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently checked out", ["pool"])
+OVERFLOW = Gauge("db_pool_overflow", "Connections open beyond the pool size, negative while the pool is not full", ["pool"])
+
+
+class _TimedCheckout:
+    """Times the wait for a connection, which the pool events do not cover"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            CHECKOUT_WAIT.labels(self.logging_name).observe(time.perf_counter() - start)
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument(engine: Engine) -> None:
+    """Count the pool events of an engine created with one of the timed pools and a pool_logging_name"""
+    name = engine.pool.logging_name
+
+    @event.listens_for(engine, "connect")
+    def connect(dbapi_connection, connection_record):
+        CONNECTS.labels(name).inc()
+
+    @event.listens_for(engine, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        CHECKOUTS.labels(name).inc()
+        connection_record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(engine, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            HELD.labels(name).observe(time.perf_counter() - checked_out_at)
+
+    @event.listens_for(engine, "invalidate")
+    def invalidate(dbapi_connection, connection_record, exception):
+        INVALIDATIONS.labels(name).inc()
+
+    # read from the current pool at scrape time, engine.dispose() replaces it
+    SIZE.labels(name).set_function(lambda: engine.pool.size())
+    CHECKED_OUT.labels(name).set_function(lambda: engine.pool.checkedout())
+    OVERFLOW.labels(name).set_function(lambda: engine.pool.overflow())
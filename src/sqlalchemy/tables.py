@@ -1,4 +1,4 @@
-from sqlalchemy import MetaData, Table, Column, String, Text, Boolean, DateTime, ForeignKey, func, text, UniqueConstraint
+from sqlalchemy import MetaData, Table, Column, String, Text, Boolean, DateTime, Integer, ForeignKey, Index, func, text, UniqueConstraint, and_, or_
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 
 metadata = MetaData()
@@ -13,6 +13,10 @@ users = Table(
     Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 )
 
+# case insensitive username prefix search, see api.search_users. In the C collation the index serves
+# LIKE 'prefix%' regardless of the db collation, and returns the matches in the order they are listed
+Index('ix_users_username_pattern', func.lower(users.c.username).collate('C'), users.c.id)
+
 follows = Table(
     'follows', metadata,
     Column('follower_id', UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), primary_key=True),
@@ -22,6 +26,19 @@ follows = Table(
     UniqueConstraint('follower_id', 'leader_id', name='uq_follower_leader')
 )
 
+# the primary key covers lookups by follower_id
+Index('ix_follows_leader_id', follows.c.leader_id)
+
+# denormalized follow counts, kept up to date by api.create_follow and api.delete_follow
+user_stats = Table(
+    'user_stats', metadata,
+    Column('user_id', UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), primary_key=True),
+    Column('followers', Integer, nullable=False, server_default=text("0")),
+    Column('leaders', Integer, nullable=False, server_default=text("0")),
+    Column('created_at', DateTime(timezone=True), server_default=func.now()),
+    Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+)
+
 goals = Table(
     'goals', metadata,
     Column('id', UUID(as_uuid=True), primary_key=True, server_default=text("uuid_generate_v4()")),
@@ -31,10 +48,19 @@ goals = Table(
     Column('description', Text, nullable=False),
     Column('due_date', DateTime(timezone=True), nullable=True),
     Column('is_completed', Boolean, default=False),
+    # denormalized, kept up to date by api.create_comment, api.create_comment_and_notify, api.delete_comment
+    # and api.delete_user
+    Column('comment_count', Integer, nullable=False, server_default=text("0")),
     Column('created_at', DateTime(timezone=True), server_default=func.now()),
     Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 )
 
+# only goals and completed milestones are announced, see api.read_announcements
+Index('ix_goals_announcements', goals.c.user_id, goals.c.created_at,
+      postgresql_where=or_(goals.c.parent_id == None, goals.c.is_completed))
+Index('ix_goals_user_id', goals.c.user_id, goals.c.created_at)
+Index('ix_goals_parent_id', goals.c.parent_id)
+
 
 reactions = Table(
     'reactions', metadata,
@@ -47,6 +73,9 @@ reactions = Table(
     Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 )
 
+Index('ix_reactions_goal_id', reactions.c.goal_id)
+Index('ix_reactions_user_id', reactions.c.user_id)
+
 
 comments = Table(
     'comments', metadata,
@@ -58,27 +87,27 @@ comments = Table(
     Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 )
 
+Index('ix_comments_goal_id', comments.c.goal_id, comments.c.created_at)
+Index('ix_comments_user_id', comments.c.user_id, comments.c.created_at)
+
 comment_subs = Table(
     'comment_subs', metadata,
     Column('id', UUID(as_uuid=True), primary_key=True, server_default=text("uuid_generate_v4()")),
     Column('user_id', UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), nullable=False),
     Column('goal_id', UUID(as_uuid=True), ForeignKey('goals.id', ondelete="CASCADE"), nullable=False),
+    # read watermark, comments on the goal after (last_read_at, last_read_comment_id) are unread
+    Column('last_read_at', DateTime(timezone=True), nullable=False, server_default=func.now()),
+    Column('last_read_comment_id', UUID(as_uuid=True), ForeignKey('comments.id', ondelete="SET NULL"), nullable=True),
     Column('created_at', DateTime(timezone=True), server_default=func.now()),
     Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now()),
     UniqueConstraint('user_id', 'goal_id', name='uq_user_goal')
 )
 
-unread_comments = Table(
-    'unread_comments', metadata,
-    Column('id', UUID(as_uuid=True), primary_key=True, server_default=text("uuid_generate_v4()")),
-    Column('user_id', UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), nullable=False),
-    Column('goal_id', UUID(as_uuid=True), ForeignKey('goals.id', ondelete="CASCADE"), nullable=False),
-    Column('comment_id', UUID(as_uuid=True), ForeignKey('comments.id', ondelete="CASCADE"), nullable=False),
-    Column('read', Boolean, default=False),
-    Column('created_at', DateTime(timezone=True), server_default=func.now()),
-    Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now()),
-    UniqueConstraint('user_id', 'comment_id', name='uq_user_comment')
-)
+# uq_user_goal covers lookups by user_id
+Index('ix_comment_subs_goal_id', comment_subs.c.goal_id)
+# for the ON DELETE SET NULL of deleted comments
+Index('ix_comment_subs_last_read_comment_id', comment_subs.c.last_read_comment_id,
+      postgresql_where=comment_subs.c.last_read_comment_id != None)
 
 devices = Table(
     'devices', metadata,
@@ -89,5 +118,45 @@ devices = Table(
     Column('expo_push_token', String, nullable=False),
     Column('active', Boolean, default=True),
     Column('created_at', DateTime(timezone=True), server_default=func.now()),
+    Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now()),
+    UniqueConstraint('expo_push_token', name='uq_expo_push_token')
+)
+
+Index('ix_devices_user_id', devices.c.user_id)
+
+# notifications are written here in the request transaction and sent by src.push_worker
+push_outbox = Table(
+    'push_outbox', metadata,
+    Column('id', UUID(as_uuid=True), primary_key=True, server_default=text("uuid_generate_v4()")),
+    Column('recipient_id', UUID(as_uuid=True), ForeignKey('users.id', ondelete="CASCADE"), nullable=False),
+    Column('expo_push_token', String, nullable=False),
+    Column('goal_id', UUID(as_uuid=True), ForeignKey('goals.id', ondelete="CASCADE"), nullable=True),
+    Column('comment_id', UUID(as_uuid=True), ForeignKey('comments.id', ondelete="CASCADE"), nullable=True),
+    Column('message', Text, nullable=False),
+    Column('status', String, nullable=False, server_default="pending"),
+    Column('attempts', Integer, nullable=False, server_default=text("0")),
+    Column('next_attempt_at', DateTime(timezone=True), nullable=False, server_default=func.now()),
+    Column('sent_at', DateTime(timezone=True), nullable=True),
+    # the Expo push ticket, used to check the delivery receipt
+    Column('ticket_id', String, nullable=True),
+    Column('receipt_checked_at', DateTime(timezone=True), nullable=True),
+    Column('last_error', Text, nullable=True),
+    Column('created_at', DateTime(timezone=True), server_default=func.now()),
     Column('updated_at', DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
-)
\ No newline at end of file
+)
+
+Index('ix_push_outbox_pending', push_outbox.c.next_attempt_at,
+      postgresql_where=push_outbox.c.status == 'pending')
+
+Index('ix_push_outbox_unchecked_receipts', push_outbox.c.sent_at,
+      postgresql_where=and_(push_outbox.c.ticket_id != None, push_outbox.c.receipt_checked_at == None))
+
+# for the ON DELETE CASCADE of deleted users, goals and comments
+Index('ix_push_outbox_recipient_id', push_outbox.c.recipient_id)
+Index('ix_push_outbox_goal_id', push_outbox.c.goal_id)
+Index('ix_push_outbox_comment_id', push_outbox.c.comment_id)
+
+# rate cap of src.push_worker, per recipient. The coalescing window needs no index of its own, since
+# claim_push_notifications joins the few pending notifications that are due, read from ix_push_outbox_pending
+Index('ix_push_outbox_sent_by_recipient', push_outbox.c.recipient_id, push_outbox.c.sent_at,
+      postgresql_where=push_outbox.c.status == 'sent')
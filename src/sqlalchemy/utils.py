@@ -1,9 +1,148 @@
-from sqlalchemy import Table, Column, Row
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections.abc import Mapping
+from datetime import datetime
+import json
+from typing import NamedTuple, TypeVar
+from uuid import UUID
+
+from pydantic import BaseModel
+from pydantic_core import to_json
+from sqlalchemy import Table, Column, ColumnElement, DateTime, Row, Select, Text, case, cast, func, literal, select, tuple_
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+
+M = TypeVar("M", bound=BaseModel)
+
+# default and maximum number of rows returned by a list query
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class JsonPage(NamedTuple):
+    """A page of a list query, rendered as a JSON array by the db"""
+    json: str
+    next_cursor: str | None
+
 
 def prefix(table: Table, prefix: str) -> list[Column]:
     """Add a prefix to the name of each column in a table"""
     return [col.label(f"{prefix}{col.name}") for col in table.columns]
 
-def filter_by_prefix(row: Row, prefix: str) -> dict:
-        """Filter key-value pairs into their respective tables based on the column name prefix"""
-        return {k[len(prefix):]: v for k, v in row._mapping.items() if k.startswith(prefix)}
\ No newline at end of file
+def columns_by_prefix(keys: list[str], prefix: str) -> dict[str, int]:
+    """Map the unprefixed column names to their position in the row. Compute it once per result, 
+    not once per row."""
+    return {k[len(prefix):]: i for i, k in enumerate(keys) if k.startswith(prefix)}
+
+def pick(row: Row, columns: dict[str, int]) -> dict:
+    """The values of the columns found by columns_by_prefix"""
+    return {name: row[i] for name, i in columns.items()}
+
+def from_row(model: type[M], values: Row | Mapping, **extra) -> M:
+    """Build a model from a db row without validating it, since the db schema already enforces the types. 
+    Nested models must be built by the caller."""
+    if isinstance(values, Row):
+        values = values._mapping
+    return model.model_construct(**values, **extra)
+
+def escape_like(value: str) -> str:
+    """Escape the LIKE wildcards in a user supplied search term"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def encode_cursor(created_at: datetime, id: UUID) -> str:
+    """Encode the position of a row as an opaque cursor"""
+    return urlsafe_b64encode(f"{created_at.isoformat()}|{id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    try:
+        created_at, id = urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), UUID(id)
+    except ValueError as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def paginate(query: Select, created_at: Column, id: Column, limit: int, cursor: str | None) -> Select:
+    """Order the query newest first and return the page of rows after the cursor (keyset pagination)"""
+    query = query.order_by(created_at.desc(), id.desc()).limit(min(limit, MAX_PAGE_SIZE))
+    if cursor:
+        query = query.where(tuple_(created_at, id) < tuple_(*decode_cursor(cursor)))
+    return query
+
+def next_cursor(items: list, limit: int) -> str | None:
+    """Return the cursor of the next page, or None if this was the last page"""
+    if not items or len(items) < min(limit, MAX_PAGE_SIZE):
+        return None
+    return encode_cursor(items[-1].created_at, items[-1].id)
+
+def encode_search_cursor(leader: bool, username: str, id: UUID) -> str:
+    """Encode the position of a user in the search results (see api.search_users) as an opaque cursor"""
+    return urlsafe_b64encode(json.dumps([leader, username, str(id)]).encode()).decode()
+
+def decode_search_cursor(cursor: str) -> tuple[bool, str, UUID]:
+    try:
+        leader, username, id = json.loads(urlsafe_b64decode(cursor.encode()))
+        if not isinstance(leader, bool) or not isinstance(username, str):
+            raise ValueError("wrong types")
+        return leader, username, UUID(id)
+    except (ValueError, TypeError, AttributeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def next_search_cursor(users: list, limit: int) -> str | None:
+    """Return the cursor of the next page of a user search, or None if this was the last page"""
+    if not users or len(users) < min(limit, MAX_PAGE_SIZE):
+        return None
+    return encode_search_cursor(users[-1].leader, users[-1].username, users[-1].id)
+
+### JSON RENDERED BY THE DB
+# byte for byte what FastAPI returns for the same models: compact, keys in field order, and datetimes 
+# in UTC, which is the session TimeZone of every connection, see connection.utc_connect_args.
+# json_build_object is not used, since it puts spaces around its separators.
+
+def json_value(value: ColumnElement) -> ColumnElement[str]:
+    """Render a column as JSON text, the way pydantic serializes it"""
+    if isinstance(value.type, DateTime):
+        utc = func.timezone("UTC", value)
+        # pydantic leaves out the fraction of whole seconds
+        timestamp = case(
+            (func.to_char(utc, "US") == "000000", func.to_char(utc, 'YYYY-MM-DD"T"HH24:MI:SS"Z"')),
+            else_=func.to_char(utc, 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"'))
+        rendered = '"' + timestamp + '"'
+    else:
+        rendered = cast(func.to_json(value), Text)
+    return func.coalesce(rendered, "null")
+
+def json_object(model: type[BaseModel], table: Table, **fields: ColumnElement[str]) -> ColumnElement[str]:
+    """Render a row as a JSON object of the model. Each field is taken from `fields` if given as JSON text, 
+    else from the table column of the same name, else it is the field's default."""
+    parts = []
+    for i, (name, field) in enumerate(model.model_fields.items()):
+        if name in fields:
+            value = fields[name]
+        elif name in table.c:
+            value = json_value(table.c[name])
+        else:
+            value = literal(to_json(field.get_default(call_default_factory=False)).decode(), Text)
+        parts += [literal(("," if i else "{") + json.dumps(name) + ":", Text), value]
+    return func.concat(*parts, literal("}", Text))
+
+def paginate_json(query: Select, created_at: Column, id: Column, limit: int, cursor: str | None) -> Select:
+    """Paginate a query selecting a JSON object labeled json per row, and aggregate the page into a JSON array. 
+    Also selects the number of rows and the position of the last one, see json_page."""
+    page = (
+        paginate(query, created_at, id, limit, cursor)
+        .add_columns(created_at.label("created_at"), id.label("id"))
+        .subquery())
+    return select(
+        func.coalesce(
+            "[" + func.string_agg(page.c.json, aggregate_order_by(literal(",", Text), page.c.created_at.desc(), page.c.id.desc())) + "]",
+            "[]").label("json"),
+        func.count().label("count"),
+        func.min(page.c.created_at).label("last_created_at"),
+        func.array_agg(aggregate_order_by(page.c.id, page.c.created_at, page.c.id))[1].label("last_id"))
+
+def json_page(row: Row, limit: int) -> JsonPage:
+    """The page selected by paginate_json"""
+    if row.count < min(limit, MAX_PAGE_SIZE):
+        return JsonPage(row.json, None)
+    return JsonPage(row.json, encode_cursor(row.last_created_at, row.last_id))
@@ -1,5 +1,6 @@
 # The types.domain should be used for all interfaces internal to the stacks-api service
 from datetime import datetime, timezone
+from enum import StrEnum
 from typing_extensions import Self
 
 from pydantic import BaseModel, Field, field_validator
@@ -49,6 +50,21 @@ class CommentEnriched(Comment):
 class GoalEnriched(Goal):
     user: User
     parent: Goal | None = None
+    comment_count: int = 0
+
+
+class GoalTree(Goal):
+    comment_count: int = 0
+    milestones: list["GoalTree"] = []
+    # of the goal's direct milestones, counted even at the depth the tree was read to, whose milestones are not read
+    milestone_count: int = 0
+    completed_milestone_count: int = 0
+
+
+class FeedItem(GoalEnriched):
+    reactions: list[Reaction] = []
+    # whether the user reading the feed has reacted to the goal
+    reacted: bool = False
 
 
 class CommentCount(BaseModel):
@@ -58,20 +74,30 @@ class CommentCount(BaseModel):
 class CommentSub(CustomBase):
     goal_id: UUID
     user_id: UUID
-
-class UnreadComment(CustomBase):
-    user_id: UUID
-    goal_id: UUID
-    comment_id: UUID
-    read: bool = False
+    last_read_at: datetime | None = None
+    last_read_comment_id: UUID | None = None
 
 class Device(CustomBase, requests.NewDevice):
     pass
 
 
-class PushNotification(BaseModel):
-    expo_push_token: str
+class PushStatus(StrEnum):
+    PENDING = "pending"
+    SENT = "sent"
+    # sent as part of the summary message of another notification
+    COALESCED = "coalesced"
+    FAILED = "failed"
+
+class PushOutbox(CustomBase):
     recipient_id: UUID
-    commenter_id: UUID
-    comment: str
-    message: str
\ No newline at end of file
+    expo_push_token: str
+    goal_id: UUID | None = None
+    comment_id: UUID | None = None
+    message: str
+    status: PushStatus = PushStatus.PENDING
+    attempts: int = 0
+    next_attempt_at: datetime | None = None
+    sent_at: datetime | None = None
+    ticket_id: str | None = None
+    receipt_checked_at: datetime | None = None
+    last_error: str | None = None
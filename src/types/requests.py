@@ -26,6 +26,15 @@ class NewGoal(BaseModel):
     def validate_id(cls, value):
         return validate_uuid(value)
 
+class NewMilestone(BaseModel):
+    description: str = Field(..., min_length=1, max_length=1000)
+    title: str | None = Field(default=None, min_length=1, max_length=100)
+    due_date: datetime | None = None
+    is_completed: bool = False
+
+class NewGoalWithMilestones(NewGoal):
+    milestones: list[NewMilestone] = Field(..., max_length=100)
+
 class UpdateGoal(BaseModel):
     title: str | None = Field(None, min_length=1, max_length=100)
     description: str | None = Field(None, min_length=1, max_length=1000)
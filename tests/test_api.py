@@ -1,6 +1,14 @@
-from unittest.mock import patch
+from datetime import datetime
+
+import pytest
+from pydantic import TypeAdapter
+from pytz import utc
+from sqlalchemy import func, select, update
 
 from src import api
+from src.sqlalchemy import tables
+from src.sqlalchemy.connection import engine
+from src.sqlalchemy.utils import InvalidCursor, encode_cursor, next_cursor, next_search_cursor
 from src.types import domain, requests
 from tests import utils
 
@@ -29,6 +37,41 @@ def test_search_users(commit_as_you_go):
     assert s_u2.leader == False
 
 
+def test_search_users_ranks_leaders_first(commit_as_you_go):
+    u0, u1, u2, u3 = utils.create_users_for_tests(commit_as_you_go, count=4)
+    api.create_follow(commit_as_you_go, domain.Follow(follower_id=u0.id, leader_id=u3.id))
+    commit_as_you_go.commit()
+
+    # u3 is followed, so it ranks above u1 and u2 which sort before it
+    s_users = api.search_users(commit_as_you_go, u0.id, q="USER")
+    assert [(u.id, u.leader) for u in s_users] == [(u3.id, True), (u1.id, False), (u2.id, False)]
+
+    assert [u.id for u in api.search_users(commit_as_you_go, u0.id, q="user2")] == [u2.id]
+    assert api.search_users(commit_as_you_go, u0.id, q="user_") == []
+    assert [u.id for u in api.search_users(commit_as_you_go, u0.id, q="user", limit=1)] == [u3.id]
+
+
+def test_search_users_paginates_with_cursor(commit_as_you_go):
+    users = utils.create_users_for_tests(commit_as_you_go, count=6)
+    u0 = users[0]
+    for leader in (users[4], users[5]):
+        api.create_follow(commit_as_you_go, domain.Follow(follower_id=u0.id, leader_id=leader.id))
+    commit_as_you_go.commit()
+
+    pages, cursor = [], None
+    while True:
+        page = api.search_users(commit_as_you_go, u0.id, limit=2, cursor=cursor)
+        pages.append([u.id for u in page])
+        cursor = next_search_cursor(page, limit=2)
+        if cursor is None:
+            break
+    # the leaders come first, then the pages carry on with the other users
+    assert pages == [[users[4].id, users[5].id], [users[1].id, users[2].id], [users[3].id]]
+
+    with pytest.raises(InvalidCursor):
+        api.search_users(commit_as_you_go, u0.id, cursor="not a cursor")
+
+
 def test_search_users_with_unknown_edge_case(commit_as_you_go):
     s_users = utils.create_users_for_tests(commit_as_you_go, count=3)
     u0 = s_users[0]
@@ -59,6 +102,62 @@ def test_create_delete_follow(commit_as_you_go):
 
     assert api.read_followers(commit_as_you_go, u0.id) == []
 
+def test_create_goal_subscribes_owner(commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    goal = api.create_goal(commit_as_you_go, domain.Goal(user_id=u0.id, description="goal"))
+    commit_as_you_go.commit()
+
+    assert goal.created_at is not None
+    assert goal.title is None and goal.is_completed is False
+    subs = commit_as_you_go.execute(select(tables.comment_subs)).all()
+    assert [(s.user_id, s.goal_id) for s in subs] == [(u0.id, goal.id)]
+
+def test_create_goal_with_milestones(commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    milestones = [requests.NewMilestone(description=f"milestone{i}", is_completed=i == 0) for i in range(30)]
+    goal, *created = api.create_goal_with_milestones(
+        commit_as_you_go, domain.Goal(user_id=u0.id, title="title", description="goal"), milestones)
+    commit_as_you_go.commit()
+
+    assert goal.title == "title" and goal.parent_id is None
+    assert [m.description for m in created] == [m.description for m in milestones]
+    assert all(m.parent_id == goal.id and m.user_id == u0.id for m in created)
+    assert created[0].is_completed and not created[1].is_completed
+    assert len(api.read_goals(commit_as_you_go, parent_id=goal.id, limit=50)) == 30
+    subs = commit_as_you_go.execute(select(tables.comment_subs.c.goal_id)).scalars().all()
+    assert set(subs) == {goal.id, *(m.id for m in created)}
+
+def test_read_goal_tree(commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    milestones = [requests.NewMilestone(description=f"m{i}", is_completed=i < 2) for i in range(3)]
+    goal, m0, m1, m2 = api.create_goal_with_milestones(
+        commit_as_you_go, domain.Goal(user_id=u0.id, description="goal"), milestones)
+    m00, m01 = api.create_goals(commit_as_you_go, [
+        domain.Goal(user_id=u0.id, parent_id=m0.id, description="m00", is_completed=True),
+        domain.Goal(user_id=u0.id, parent_id=m0.id, description="m01")])
+    m000 = api.create_goal(commit_as_you_go, domain.Goal(user_id=u0.id, parent_id=m00.id, description="m000"))
+    commit_as_you_go.commit()
+
+    tree = api.read_goal_tree(commit_as_you_go, goal.id)
+    assert tree.id == goal.id
+    assert (tree.milestone_count, tree.completed_milestone_count) == (3, 2)
+    # milestones created together have the same created_at, so their order is arbitrary
+    by_id = {m.id: m for m in tree.milestones}
+    assert by_id.keys() == {m0.id, m1.id, m2.id}
+    assert {m.id for m in by_id[m0.id].milestones} == {m00.id, m01.id}
+    assert (by_id[m0.id].milestone_count, by_id[m0.id].completed_milestone_count) == (2, 1)
+    assert [m.id for m00_node in by_id[m0.id].milestones for m in m00_node.milestones] == [m000.id]
+    assert by_id[m1.id].milestones == [] and by_id[m1.id].milestone_count == 0
+
+    # nodes at max_depth still count their milestones
+    tree = api.read_goal_tree(commit_as_you_go, goal.id, max_depth=1)
+    m0_node = next(m for m in tree.milestones if m.id == m0.id)
+    assert m0_node.milestones == []
+    assert m0_node.milestone_count == 2
+
+    assert api.read_goal_tree(commit_as_you_go, m000.id).milestones == []
+    assert api.read_goal_tree(commit_as_you_go, u0.id) is None
+
 def test_create_read_update_delete_goal(commit_as_you_go):
     u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
     goal = domain.Goal(user_id=u0.id, title="title", description="goal-description", due_date="2022-01-01")
@@ -81,6 +180,51 @@ def test_create_read_update_delete_goal(commit_as_you_go):
     assert api.read_goals(commit_as_you_go, u0.id) == []
 
 
+def test_read_goals_paginated(commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    goals = utils.create_goals_for_tests(commit_as_you_go, [u0], count=5)
+
+    pages, cursor = [], None
+    while True:
+        page = api.read_goals(commit_as_you_go, u0.id, limit=2, cursor=cursor)
+        pages.append(page)
+        cursor = next_cursor(page, limit=2)
+        if cursor is None:
+            break
+
+    assert [len(p) for p in pages] == [2, 2, 1]
+    assert sorted(g.id for p in pages for g in p) == sorted(g.id for g in goals)
+
+    with pytest.raises(InvalidCursor):
+        api.read_goals(commit_as_you_go, u0.id, cursor="not-a-cursor")
+
+
+def test_read_goals_announcements_only(commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
+    m0, m1 = utils.create_milestones_for_tests(commit_as_you_go, [g0], count=2)
+    api.update_goal(commit_as_you_go, m0.id, requests.UpdateGoal(is_completed=True))
+    commit_as_you_go.commit()
+
+    assert len(api.read_goals(commit_as_you_go, u0.id)) == 3
+    announcements = api.read_goals(commit_as_you_go, u0.id, announcements_only=True)
+    assert {g.id for g in announcements} == {g0.id, m0.id}
+
+
+def test_read_goals_hydrates_same_models_as_validation(commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
+    m0 = utils.create_milestones_for_tests(commit_as_you_go, [g0], count=1)[0]
+
+    goals = {g.id: g for g in api.read_goals(commit_as_you_go, u0.id)}
+    assert goals[g0.id].parent is None
+    assert goals[m0.id].parent == g0
+    assert goals[m0.id].user == u0
+    # the trusted models serialize exactly like validated ones
+    validated = domain.GoalEnriched.model_validate(goals[m0.id].model_dump())
+    assert goals[m0.id].model_dump_json() == validated.model_dump_json()
+
+
 def test_create_read_delete_reaction(commit_as_you_go):
     u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
     g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
@@ -128,6 +272,78 @@ def test_read_announcements(commit_as_you_go):
     assert len(timeline2) == 2
 
 
+def test_read_announcements_newest_first_with_limit(commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    utils.create_goals_for_tests(commit_as_you_go, users=[u0], count=1)
+    goals = utils.create_goals_for_tests(commit_as_you_go, users=[u1], count=2)
+    milestone = utils.create_milestones_for_tests(commit_as_you_go, goals[:1], count=1)[0]
+    api.update_goal(commit_as_you_go, milestone.id, requests.UpdateGoal(is_completed=True))
+    api.create_follow(commit_as_you_go, domain.Follow(follower_id=u0.id, leader_id=u1.id))
+    commit_as_you_go.commit()
+
+    announcements = api.read_announcements(commit_as_you_go, u0.id)
+    assert len(announcements) == 4
+    assert announcements[0].id == milestone.id
+    assert announcements[0].parent.id == goals[0].id
+    assert [a.created_at for a in announcements] == sorted([a.created_at for a in announcements], reverse=True)
+
+    assert len(api.read_announcements(commit_as_you_go, u0.id, limit=2)) == 2
+
+
+def test_read_json_matches_pydantic_serialization(commit_as_you_go):
+    conn = commit_as_you_go
+    u0, u1 = utils.create_users_for_tests(conn, count=2)
+    utils.create_follows_for_tests(conn, [u0, u1])
+    goals = utils.create_goals_for_tests(conn, [u0, u1], count=2)
+    milestones = utils.create_milestones_for_tests(conn, goals[:1], count=2)
+    api.update_goal(conn, goals[0].id, requests.UpdateGoal(description='quotes " \\ new\nline \x01 ünïcødé 😁'))
+    # pydantic leaves out the fraction of whole seconds
+    conn.execute(update(tables.goals).where(tables.goals.c.id == milestones[0].id).values(
+        created_at=datetime(2026, 1, 1, tzinfo=utc), due_date=datetime(2026, 1, 1, 12, 30, 0, 120000, tzinfo=utc)))
+    utils.create_comments_for_tests(conn, u1, goals[:2], count=2)
+    conn.commit()
+
+    def dumped(items) -> str:
+        return TypeAdapter(list).dump_json(items).decode()
+
+    for read, read_json, kwargs in [
+            (api.read_goals, api.read_goals_json, dict(user_id=u0.id)),
+            (api.read_announcements, api.read_announcements_json, dict(user_id=u0.id)),
+            (api.read_comments, api.read_comments_json, dict(user_id=u1.id)),
+            (api.read_followers, api.read_followers_json, dict(leader_id=u0.id))]:
+        cursor = None
+        while True:
+            page = read(conn, **kwargs, limit=2, cursor=cursor)
+            json_page = read_json(conn, **kwargs, limit=2, cursor=cursor)
+            assert json_page.json == dumped(page), read.__name__
+            assert json_page.next_cursor == next_cursor(page, limit=2)
+            cursor = json_page.next_cursor
+            if cursor is None:
+                break
+
+    assert api.read_goals_json(conn, user_id=u0.id, cursor=encode_cursor(datetime(2000, 1, 1, tzinfo=utc), u0.id)).json == "[]"
+
+
+def test_read_feed(commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    g0, g1 = utils.create_goals_for_tests(commit_as_you_go, users=[u0, u1], count=1)
+    api.create_follow(commit_as_you_go, domain.Follow(follower_id=u0.id, leader_id=u1.id))
+    utils.create_reactions_for_tests(commit_as_you_go, u0, [g1], count=1)
+    utils.create_reactions_for_tests(commit_as_you_go, u1, [g0, g1], count=1)
+    api.create_comment(commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=g1.id))
+    api.create_comment(commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=g1.id))
+    commit_as_you_go.commit()
+
+    feed = {item.id: item for item in api.read_feed(commit_as_you_go, u0.id)}
+    assert feed.keys() == {g0.id, g1.id}
+    assert feed[g1.id].user.id == u1.id
+    assert len(feed[g1.id].reactions) == 2
+    assert feed[g1.id].reacted == True
+    assert feed[g1.id].comment_count == 2
+    assert feed[g0.id].reacted == False
+    assert feed[g0.id].comment_count == 0
+
+
 def test_follow_counts(commit_as_you_go):
     u0, u1, u2 = utils.create_users_for_tests(commit_as_you_go, count=3)
     api.create_follow(commit_as_you_go, domain.Follow(follower_id=u1.id, leader_id=u0.id))
@@ -142,6 +358,30 @@ def test_follow_counts(commit_as_you_go):
     assert follow_counts.followers == 0
     assert follow_counts.leaders == 1
 
+def test_follow_counts_after_delete_and_repair(commit_as_you_go):
+    u0, u1, u2 = utils.create_users_for_tests(commit_as_you_go, count=3)
+    follow = domain.Follow(follower_id=u1.id, leader_id=u0.id)
+    api.create_follow(commit_as_you_go, follow)
+    api.create_follow(commit_as_you_go, domain.Follow(follower_id=u2.id, leader_id=u0.id))
+    api.delete_follow(commit_as_you_go, follow)
+    api.delete_follow(commit_as_you_go, follow)
+    commit_as_you_go.commit()
+
+    assert api.read_follow_counts(commit_as_you_go, u0.id).followers == 1
+    assert api.read_follow_counts(commit_as_you_go, u1.id).leaders == 0
+
+    api.delete_user(commit_as_you_go, u2.id)
+    commit_as_you_go.commit()
+    assert api.read_follow_counts(commit_as_you_go, u0.id).followers == 0
+
+    # follows inserted behind the api's back are picked up by the repair
+    utils.create_follows_for_tests(commit_as_you_go, [u0, u1])
+    assert api.repair_follow_counts(commit_as_you_go) == 2
+    commit_as_you_go.commit()
+    assert api.read_follow_counts(commit_as_you_go, u0.id) == domain.FollowCounts(followers=1, leaders=1)
+    assert api.repair_follow_counts(commit_as_you_go) == 0
+
+
 def test_read_comment_count(commit_as_you_go):
     u0, u1, u2 = utils.create_users_for_tests(commit_as_you_go, count=3)
     g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
@@ -153,6 +393,38 @@ def test_read_comment_count(commit_as_you_go):
     comment_count = api.read_comment_count(commit_as_you_go, g0.id)
     assert comment_count.count == 2
 
+def test_comment_count_after_delete_and_repair(commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
+    c0 = api.create_comment(commit_as_you_go, domain.Comment(user_id=u0.id, comment='comment', goal_id=g0.id))
+    api.create_comment(commit_as_you_go, domain.Comment(user_id=u0.id, comment='comment', goal_id=g0.id))
+    api.delete_comment(commit_as_you_go, c0.id)
+    commit_as_you_go.commit()
+
+    assert api.read_comment_count(commit_as_you_go, g0.id).count == 1
+    assert api.read_goals(commit_as_you_go, goal_ids=[g0.id])[0].comment_count == 1
+
+    # comments inserted behind the api's back are picked up by the repair
+    utils.create_comments_for_tests(commit_as_you_go, u0, [g0], count=2)
+    assert api.repair_comment_counts(commit_as_you_go) == 1
+    commit_as_you_go.commit()
+    assert api.read_comment_count(commit_as_you_go, g0.id).count == 3
+    assert api.repair_comment_counts(commit_as_you_go) == 0
+
+def test_comment_count_after_delete_user(commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    g0, g1 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=2)
+    for goal in (g0, g0, g1):
+        api.create_comment(commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=goal.id))
+    api.create_comment(commit_as_you_go, domain.Comment(user_id=u0.id, comment='comment', goal_id=g0.id))
+    commit_as_you_go.commit()
+
+    api.delete_user(commit_as_you_go, u1.id)
+    commit_as_you_go.commit()
+    counts = {goal.id: goal.comment_count for goal in api.read_goals(commit_as_you_go, goal_ids=[g0.id, g1.id])}
+    assert counts == {g0.id: 1, g1.id: 0}
+    assert api.repair_comment_counts(commit_as_you_go) == 0
+
 def test_read_comment_counts(commit_as_you_go):
     u0, u1, u2 = utils.create_users_for_tests(commit_as_you_go, count=3)
     g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
@@ -165,36 +437,58 @@ def test_read_comment_counts(commit_as_you_go):
     assert comment_counts[0].count == 2
 
 
-def test_create_unread_comment(commit_as_you_go):
+def test_read_unread_comment_count(commit_as_you_go):
     u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
     g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
 
     api.create_comment_sub(commit_as_you_go, domain.CommentSub(goal_id=g0.id, user_id=u0.id))
     api.create_comment_sub(commit_as_you_go, domain.CommentSub(goal_id=g0.id, user_id=u1.id))
-    c0 = api.create_comment(commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=g0.id))
+    api.create_comment(commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=g0.id))
     commit_as_you_go.commit()
 
-    unreads = api.create_unread_comments(commit_as_you_go, c0)
+    assert api.read_unread_comment_count(commit_as_you_go, u0.id) == 1
+    # the author has not missed their own comment
+    assert api.read_unread_comment_count(commit_as_you_go, u1.id) == 0
 
-    assert len(unreads) == 1
-    assert all([u.read == False for u in unreads])
 
+def test_update_read_watermarks(commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    g0, g1 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=2)
+    utils.create_comment_subs_for_tests(commit_as_you_go, [g0.id, g1.id], [u0.id])
 
-def update_unread_comment(commit_as_you_go):
-    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
-    g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
+    c0, c1 = utils.create_comments_for_tests(commit_as_you_go, u1, [g0, g1], count=1)
+    c2 = utils.create_comments_for_tests(commit_as_you_go, u1, [g0], count=1)[0]
+    assert api.read_unread_comment_count(commit_as_you_go, u0.id) == 3
 
-    api.create_comment_sub(commit_as_you_go, domain.CommentSub(goal_id=g0.id, user_id=u0.id))
-    c0 = api.create_comment(commit_as_you_go, domain.Comment(user_id=u0.id, comment='comment', goal_id=g0.id))
+    # reading c2 moves the watermark past the older c0 on the same goal, but not past c1 on another goal
+    api.update_read_watermarks(commit_as_you_go, u0.id, [c2.id])
+    commit_as_you_go.commit()
+    assert [c.id for c in api.read_unread_comments(commit_as_you_go, u0.id)] == [c1.id]
+
+    # watermarks never move backwards
+    api.update_read_watermarks(commit_as_you_go, u0.id, [c0.id, c1.id])
     commit_as_you_go.commit()
+    assert api.read_unread_comments(commit_as_you_go, u0.id) == []
 
-    api.create_unread_comments(commit_as_you_go, c0)
 
-    api.update_unread_comments(commit_as_you_go, u0.id, [c0])
+def test_comment_committed_after_a_newer_one_was_read_stays_unread(commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
+    api.create_comment_sub(commit_as_you_go, domain.CommentSub(goal_id=g0.id, user_id=u0.id))
     commit_as_you_go.commit()
 
-    unreads = api.read_unread_comments(commit_as_you_go, u0.id)
-    assert all([u.read == True for u in unreads])
+    with engine.connect() as slow:
+        # a transaction that began before the comment the reader reads, and commits after the read
+        slow.execute(select(func.now()))
+        c0, _ = api.create_comment_and_notify(
+            commit_as_you_go, domain.Comment(user_id=u1.id, comment='first', goal_id=g0.id))
+        commit_as_you_go.commit()
+        api.update_read_watermarks(commit_as_you_go, u0.id, [c0.id])
+        commit_as_you_go.commit()
+        c1, _ = api.create_comment_and_notify(slow, domain.Comment(user_id=u1.id, comment='late', goal_id=g0.id))
+        slow.commit()
+
+    assert [c.id for c in api.read_unread_comments(commit_as_you_go, u0.id)] == [c1.id]
 
 
 def test_read_unread_comments(commit_as_you_go):
@@ -205,10 +499,6 @@ def test_read_unread_comments(commit_as_you_go):
     c0 = api.create_comment(commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=g0.id))
     commit_as_you_go.commit()
 
-    s_unreads = api.create_unread_comments(commit_as_you_go, c0)
-
-    commit_as_you_go.commit()
-
     unreads = api.read_unread_comments(commit_as_you_go, u0.id)
     assert len(unreads) == 1
     assert unreads[0].id == c0.id
@@ -223,18 +513,65 @@ def test_create_read_devices(commit_as_you_go):
 
     assert api.read_devices(commit_as_you_go, [u0.id])[0].id == db_device.id
 
+def test_create_device_upserts_by_push_token(commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    d0 = api.create_device(commit_as_you_go, domain.Device(user_id=u0.id, os='os', version='1', expo_push_token='token', active=False))
+    commit_as_you_go.commit()
+    d1 = api.create_device(commit_as_you_go, domain.Device(user_id=u1.id, os='os', version='2', expo_push_token='token'))
+    commit_as_you_go.commit()
+
+    assert d1.id == d0.id
+    assert (d1.user_id, d1.version, d1.active) == (u1.id, '2', True)
+    assert d1.updated_at > d0.updated_at
+    assert api.read_devices(commit_as_you_go, [u0.id, u1.id]) == [d1]
+
 def test_push_notify_unread_comments(commit_as_you_go):
     u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
     d0 = api.create_device(commit_as_you_go, domain.Device(user_id=u0.id, os='os', version='version', expo_push_token='token'))
+    api.create_device(commit_as_you_go, domain.Device(user_id=u1.id, os='os', version='version', expo_push_token='token1'))
+    api.create_device(commit_as_you_go, domain.Device(user_id=u0.id, os='os', version='version', expo_push_token='token2', active=False))
     g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
     api.create_comment_sub(commit_as_you_go, domain.CommentSub(goal_id=g0.id, user_id=u0.id))
     c0 = api.create_comment(commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=g0.id))
-    unread_comments = api.create_unread_comments(commit_as_you_go, c0)
+    api.create_comment_sub(commit_as_you_go, domain.CommentSub(goal_id=g0.id, user_id=u1.id))
+
+    commit_as_you_go.commit()
+
+    # notifications are only queued, the push worker sends them
+    notifs = api.push_notify_unread_comments(commit_as_you_go, c0)
+    commit_as_you_go.commit()
+
+    assert len(notifs) == 1
+    assert notifs[0].expo_push_token == d0.expo_push_token
+    assert notifs[0].recipient_id == u0.id
+    assert notifs[0].status == domain.PushStatus.PENDING
+    assert c0.comment in notifs[0].message
+
+def test_create_comment_and_notify(commit_as_you_go):
+    u0, u1, u2 = utils.create_users_for_tests(commit_as_you_go, count=3)
+    d0 = api.create_device(commit_as_you_go, domain.Device(user_id=u0.id, os='os', version='version', expo_push_token='token'))
+    api.create_device(commit_as_you_go, domain.Device(user_id=u1.id, os='os', version='version', expo_push_token='token1'))
+    d2 = api.create_device(commit_as_you_go, domain.Device(user_id=u2.id, os='os', version='version', expo_push_token='token2'))
+    g0, g1 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=2)
+    utils.create_comment_subs_for_tests(commit_as_you_go, [g0.id], [u0.id, u2.id])
+    commit_as_you_go.commit()
 
+    c0, notifs = api.create_comment_and_notify(
+        commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=g0.id))
     commit_as_you_go.commit()
 
-    with patch('src.api.send_message') as mock_send_message:
-        api.push_notify_unread_comments(commit_as_you_go, unread_comments)
-        assert mock_send_message.call_count == 1
-        assert mock_send_message.call_args[0][0] == d0.expo_push_token
-        assert c0.comment in mock_send_message.call_args[0][1]
+    assert api.read_comments(commit_as_you_go, goal_id=g0.id)[0].id == c0.id
+    assert c0.created_at is not None
+    assert api.read_comment_count(commit_as_you_go, g0.id).count == 1
+    assert {n.expo_push_token for n in notifs} == {d0.expo_push_token, d2.expo_push_token}
+    assert all(n.comment_id == c0.id and n.message == "user1 commented on your goal: comment" for n in notifs)
+    # the author is subscribed, so they are notified of the replies
+    _, notifs = api.create_comment_and_notify(
+        commit_as_you_go, domain.Comment(user_id=u0.id, comment='reply', goal_id=g0.id))
+    assert {n.recipient_id for n in notifs} == {u1.id, u2.id}
+
+    # no subscribers to notify
+    c1, notifs = api.create_comment_and_notify(
+        commit_as_you_go, domain.Comment(user_id=u1.id, comment='comment', goal_id=g1.id))
+    assert c1.goal_id == g1.id
+    assert notifs == []
@@ -0,0 +1,33 @@
+from unittest.mock import patch
+
+from exponent_server_sdk import DeviceNotRegisteredError, PushMessage
+from requests.exceptions import ConnectionError
+
+from src import push_notifications
+from tests.utils import publish_for_tests
+
+
+def test_send_messages_in_chunks():
+    messages = [PushMessage(to=f"token{i}", body="body") for i in range(250)]
+    messages[120] = PushMessage(to="dead-token", body="body")
+
+    with patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests) as mock_publish:
+        results = push_notifications.send_messages(messages)
+
+    assert [len(c.args[0]) for c in mock_publish.call_args_list] == [100, 100, 50]
+    assert [r.message for r in results] == messages
+    assert results[0].ticket.id == "ticket-token0"
+    assert results[0].error is None
+    assert isinstance(results[120].error, DeviceNotRegisteredError)
+    assert sum(r.error is None for r in results) == 249
+
+
+def test_send_messages_reports_failed_chunks():
+    messages = [PushMessage(to=f"token{i}", body="body") for i in range(150)]
+    responses = [ConnectionError("down"), publish_for_tests(messages[100:])]
+
+    with patch('src.push_notifications.client.publish_multiple', side_effect=responses):
+        results = push_notifications.send_messages(messages)
+
+    assert all(isinstance(r.error, ConnectionError) and r.ticket is None for r in results[:100])
+    assert all(r.error is None for r in results[100:])
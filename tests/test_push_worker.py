@@ -0,0 +1,247 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from exponent_server_sdk import PushReceipt
+import pytest
+from requests.exceptions import ConnectionError
+from sqlalchemy import func, select, update
+
+from src import api, push_worker
+from src.sqlalchemy import tables
+from src.types import domain
+from tests import utils
+from tests.utils import publish_for_tests
+
+
+@pytest.fixture(autouse=True)
+def no_coalesce_window():
+    with patch('src.push_worker.COALESCE_WINDOW', timedelta(0)):
+        yield
+
+
+def queue_notifications_for_tests(conn, count=1) -> list[domain.PushOutbox]:
+    u0, u1 = utils.create_users_for_tests(conn, count=2)
+    for i in range(count):
+        api.create_device(conn, domain.Device(user_id=u0.id, os='os', version='version', expo_push_token=f'token{i}'))
+    g0 = utils.create_goals_for_tests(conn, [u0], count=1)[0]
+    api.create_comment_sub(conn, domain.CommentSub(goal_id=g0.id, user_id=u0.id))
+    c0 = api.create_comment(conn, domain.Comment(user_id=u1.id, comment='comment', goal_id=g0.id))
+    notifs = api.push_notify_unread_comments(conn, c0)
+    conn.commit()
+    return notifs
+
+
+def read_outbox(conn) -> dict:
+    rows = conn.execute(select(tables.push_outbox)).all()
+    return {row.id: domain.PushOutbox(**row._mapping) for row in rows}
+
+
+def test_drain_sends_and_marks_sent(commit_as_you_go):
+    notifs = queue_notifications_for_tests(commit_as_you_go, count=2)
+
+    with patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests) as mock_publish:
+        assert push_worker.drain() == 2
+        assert mock_publish.call_count == 1
+        assert {m.to for m in mock_publish.call_args.args[0]} == {'token0', 'token1'}
+
+    outbox = read_outbox(commit_as_you_go)
+    assert all(outbox[n.id].status == domain.PushStatus.SENT for n in notifs)
+    assert all(outbox[n.id].attempts == 1 for n in notifs)
+    assert {outbox[n.id].ticket_id for n in notifs} == {'ticket-token0', 'ticket-token1'}
+
+    with patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests):
+        assert push_worker.drain() == 0
+
+
+def test_drain_backs_off_then_gives_up(commit_as_you_go):
+    notif = queue_notifications_for_tests(commit_as_you_go)[0]
+
+    with patch('src.push_notifications.client.publish_multiple', side_effect=ConnectionError("down")):
+        assert push_worker.drain() == 1
+        s_notif = read_outbox(commit_as_you_go)[notif.id]
+        assert s_notif.status == domain.PushStatus.PENDING
+        assert s_notif.next_attempt_at > s_notif.created_at + push_worker.BACKOFF / 2
+        assert "down" in s_notif.last_error
+
+        # not due again until the backoff has passed
+        assert push_worker.drain() == 0
+
+        for _ in range(push_worker.MAX_ATTEMPTS - 1):
+            commit_as_you_go.execute(update(tables.push_outbox).values(next_attempt_at=s_notif.created_at))
+            commit_as_you_go.commit()
+            assert push_worker.drain() == 1
+
+    s_notif = read_outbox(commit_as_you_go)[notif.id]
+    assert s_notif.status == domain.PushStatus.FAILED
+    assert s_notif.attempts == push_worker.MAX_ATTEMPTS
+
+
+def test_drain_gives_up_on_unregistered_devices(commit_as_you_go):
+    notif = queue_notifications_for_tests(commit_as_you_go)[0]
+    commit_as_you_go.execute(update(tables.push_outbox).values(expo_push_token='dead-token'))
+    commit_as_you_go.execute(update(tables.devices).values(expo_push_token='dead-token'))
+    commit_as_you_go.commit()
+
+    with patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests):
+        assert push_worker.drain() == 1
+
+    s_notif = read_outbox(commit_as_you_go)[notif.id]
+    assert s_notif.status == domain.PushStatus.FAILED
+    assert "DeviceNotRegistered" in s_notif.last_error
+    assert api.read_devices(commit_as_you_go, [notif.recipient_id])[0].active == False
+
+
+def test_check_receipts_deactivates_unregistered_devices(commit_as_you_go):
+    n0 = queue_notifications_for_tests(commit_as_you_go, count=2)[0]
+    with patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests):
+        push_worker.drain()
+
+    # receipts are only checked once Expo has had time to deliver
+    with patch('src.push_notifications.client.check_receipts_multiple') as mock_check_receipts:
+        assert push_worker.check_receipts() == 0
+        assert mock_check_receipts.call_count == 0
+
+    commit_as_you_go.execute(
+        update(tables.push_outbox).values(sent_at=tables.push_outbox.c.sent_at - push_worker.RECEIPT_DELAY))
+    commit_as_you_go.commit()
+    receipts = [
+        PushReceipt('ticket-token0', PushReceipt.SUCCESS_STATUS, '', None),
+        PushReceipt('ticket-token1', PushReceipt.ERROR_STATUS, '', {'error': PushReceipt.ERROR_DEVICE_NOT_REGISTERED})]
+    with patch('src.push_notifications.client.check_receipts_multiple', return_value=receipts):
+        assert push_worker.check_receipts() == 2
+        assert push_worker.check_receipts() == 0
+
+    outbox = {n.expo_push_token: n for n in read_outbox(commit_as_you_go).values()}
+    assert outbox['token0'].status == domain.PushStatus.SENT
+    assert outbox['token1'].status == domain.PushStatus.FAILED
+    devices = {d.expo_push_token: d for d in api.read_devices(commit_as_you_go, [n0.recipient_id])}
+    assert devices['token0'].active == True
+    assert devices['token1'].active == False
+
+
+def test_check_receipts_retries_when_expo_is_down(commit_as_you_go):
+    queue_notifications_for_tests(commit_as_you_go)
+    with patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests):
+        push_worker.drain()
+    commit_as_you_go.execute(
+        update(tables.push_outbox).values(sent_at=tables.push_outbox.c.sent_at - push_worker.RECEIPT_DELAY))
+    commit_as_you_go.commit()
+
+    with patch('src.push_notifications.client.check_receipts_multiple', side_effect=ConnectionError("down")):
+        assert push_worker.check_receipts() == 0
+    with patch('src.push_notifications.client.check_receipts_multiple', return_value=[]):
+        assert push_worker.check_receipts() == 1
+
+
+def test_claimed_notifications_are_leased(commit_as_you_go):
+    queue_notifications_for_tests(commit_as_you_go)
+
+    claimed = api.claim_push_notifications(commit_as_you_go, 10, timedelta(minutes=5))
+    commit_as_you_go.commit()
+    assert len(claimed) == 1
+    assert api.claim_push_notifications(commit_as_you_go, 10, timedelta(minutes=5)) == []
+
+
+def test_main_keeps_running_after_errors():
+    # KeyboardInterrupt is not an Exception, so it stops the loop
+    with (patch('src.push_worker.check_receipts', return_value=0),
+          patch('src.push_worker.drain', side_effect=[ConnectionError("db is down"), 0, KeyboardInterrupt]) as mock_drain,
+          patch('src.push_worker.time.sleep') as mock_sleep):
+        with pytest.raises(KeyboardInterrupt):
+            push_worker.main()
+    assert mock_drain.call_count == 3
+    assert mock_sleep.call_count == 2
+
+
+def test_retry_in():
+    assert push_worker.retry_in(1) == push_worker.BACKOFF
+    assert push_worker.retry_in(3) == push_worker.BACKOFF * 4
+    assert push_worker.retry_in(push_worker.MAX_ATTEMPTS) is None
+
+
+def test_drain_coalesces_comments_on_the_same_goal(commit_as_you_go):
+    conn = commit_as_you_go
+    u0, u1, u2 = utils.create_users_for_tests(conn, count=3)
+    api.create_device(conn, domain.Device(user_id=u0.id, os='os', version='version', expo_push_token='token0'))
+    g0 = utils.create_goals_for_tests(conn, [u0], count=1)[0]
+    api.create_comment_sub(conn, domain.CommentSub(goal_id=g0.id, user_id=u0.id))
+    notifs = []
+    # one transaction per comment, as in the api, so each notification has its own created_at
+    for user in (u1, u2, u1):
+        comment = api.create_comment(conn, domain.Comment(user_id=user.id, comment='comment', goal_id=g0.id))
+        notifs += api.push_notify_unread_comments(conn, comment)
+        conn.commit()
+
+    # still inside the window
+    with patch('src.push_worker.COALESCE_WINDOW', timedelta(minutes=1)):
+        assert push_worker.drain() == 0
+
+    with patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests) as mock_publish:
+        assert push_worker.drain() == 3
+        messages = mock_publish.call_args.args[0]
+        assert len(messages) == 1
+        assert messages[0].body == f"3 new comments from {u1.username}, {u2.username}"
+
+    outbox = read_outbox(conn)
+    statuses = sorted(outbox[n.id].status for n in notifs)
+    assert statuses == [domain.PushStatus.COALESCED, domain.PushStatus.COALESCED, domain.PushStatus.SENT]
+    assert {outbox[n.id].ticket_id for n in notifs} == {'ticket-token0'}
+
+
+def test_drain_defers_pushes_over_the_rate_cap(commit_as_you_go):
+    notif = queue_notifications_for_tests(commit_as_you_go)[0]
+
+    with (
+        patch('src.push_worker.MAX_PUSHES_PER_MINUTE', 0),
+        patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests) as mock_publish,
+    ):
+        assert push_worker.drain() == 1
+        assert mock_publish.call_count == 0
+
+    s_notif = read_outbox(commit_as_you_go)[notif.id]
+    assert s_notif.status == domain.PushStatus.PENDING
+    assert s_notif.attempts == 0
+    assert s_notif.next_attempt_at > s_notif.created_at
+
+
+def test_rate_cap_counts_a_push_to_several_devices_once(commit_as_you_go):
+    conn = commit_as_you_go
+    notifs = queue_notifications_for_tests(conn, count=2)
+    goal_id, recipient_id = notifs[0].goal_id, notifs[0].recipient_id
+
+    with (
+        patch('src.push_worker.MAX_PUSHES_PER_MINUTE', 1),
+        patch('src.push_notifications.client.publish_multiple', side_effect=publish_for_tests) as mock_publish,
+    ):
+        assert push_worker.drain() == 2
+        assert {m.to for m in mock_publish.call_args.args[0]} == {'token0', 'token1'}
+        assert api.read_push_counts(conn, [recipient_id], timedelta(minutes=1))[recipient_id] == 1
+
+        commenter_id = conn.execute(select(tables.comments.c.user_id)).scalar()
+        comment = api.create_comment(conn, domain.Comment(user_id=commenter_id, comment='again', goal_id=goal_id))
+        api.push_notify_unread_comments(conn, comment)
+        conn.commit()
+        assert push_worker.drain() == 2
+        assert mock_publish.call_count == 1
+
+    statuses = [n.status for n in read_outbox(conn).values()]
+    assert statuses.count(domain.PushStatus.PENDING) == 2
+
+
+def test_due_notifications_wait_for_window_despite_older_ones_in_backoff(commit_as_you_go):
+    conn = commit_as_you_go
+    old = queue_notifications_for_tests(conn)[0]
+    # the first notification failed long ago and is backing off
+    conn.execute(update(tables.push_outbox).values(
+        created_at=func.now() - timedelta(minutes=5), next_attempt_at=func.now() + timedelta(minutes=5)))
+    commenter_id = conn.execute(select(tables.comments.c.user_id)).scalar()
+    comment = api.create_comment(conn, domain.Comment(user_id=commenter_id, comment='new', goal_id=old.goal_id))
+    new = api.push_notify_unread_comments(conn, comment)[0]
+    conn.commit()
+
+    assert api.claim_push_notifications(conn, 10, timedelta(minutes=5), timedelta(minutes=1)) == []
+
+    # once the old one is due, both are claimed together
+    conn.execute(update(tables.push_outbox).where(tables.push_outbox.c.id == old.id).values(next_attempt_at=func.now()))
+    claimed = api.claim_push_notifications(conn, 10, timedelta(minutes=5), timedelta(minutes=1))
+    assert {n.id for n in claimed} == {old.id, new.id}
@@ -0,0 +1,195 @@
+"""Check that the hot queries in src.api use their indexes.
+
+Each case runs an api function against a seeded db, captures the sql it sends, and checks the
+`EXPLAIN (FORMAT JSON)` plans of its statements, with the planner's default settings. The seed is
+sized so that scanning a whole table costs more than the indexed lookups. A plan fails if it
+- scans a table sequentially,
+- scans a whole index, i.e. with no Index Cond, only a Filter,
+- does not look up the indexes the case names in an Index Cond.
+"""
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event, select, text
+
+from src import api
+from src.sqlalchemy import tables
+from src.types import domain
+
+USERS = 10000
+LEADERS_PER_USER = 20
+GOALS_PER_USER = 10
+COMMENTS = 100000
+REACTIONS = 30000
+COMMENT_SUBS = 50000
+NOTIFICATIONS = 200000
+
+SEED = [
+    f"""INSERT INTO users (username, email, created_at)
+        SELECT 'user' || i, 'u' || i || '@a.b', now() - i * interval '1 minute'
+        FROM generate_series(1, {USERS}) i""",
+    # the stats of the tables the next inserts join on, so they are not planned as if the tables were empty
+    "ANALYZE users",
+    f"""INSERT INTO follows (follower_id, leader_id)
+        SELECT f.id, l.id
+        FROM (SELECT id, row_number() OVER (ORDER BY id) n FROM users) f
+        CROSS JOIN generate_series(1, {LEADERS_PER_USER}) k
+        JOIN (SELECT id, row_number() OVER (ORDER BY id) n FROM users) l ON l.n = (f.n + k * 37) % {USERS} + 1
+        ON CONFLICT DO NOTHING""",
+    f"""INSERT INTO goals (user_id, description, is_completed, created_at)
+        SELECT u.id, 'goal', k % 3 = 0, now() - k * interval '1 hour'
+        FROM users u CROSS JOIN generate_series(1, {GOALS_PER_USER // 2}) k""",
+    """INSERT INTO goals (user_id, parent_id, description, is_completed, created_at)
+       SELECT user_id, id, 'milestone', is_completed, created_at + interval '1 minute' FROM goals""",
+    "ANALYZE goals",
+    f"""INSERT INTO comments (user_id, goal_id, comment, created_at)
+        SELECT u.id, g.id, 'comment', now() - i * interval '1 second'
+        FROM generate_series(1, {COMMENTS}) i
+        JOIN (SELECT id, row_number() OVER (ORDER BY id) n FROM goals) g ON g.n = i % {USERS * GOALS_PER_USER} + 1
+        JOIN (SELECT id, row_number() OVER (ORDER BY id) n FROM users) u ON u.n = i * 7 % {USERS} + 1""",
+    "ANALYZE comments",
+    """UPDATE goals SET comment_count = c.count
+       FROM (SELECT goal_id, count(*) FROM comments GROUP BY goal_id) c WHERE c.goal_id = goals.id""",
+    """INSERT INTO user_stats (user_id, followers, leaders)
+       SELECT u.id,
+              (SELECT count(*) FROM follows WHERE leader_id = u.id),
+              (SELECT count(*) FROM follows WHERE follower_id = u.id)
+       FROM users u""",
+    f"""INSERT INTO reactions (user_id, goal_id, reaction, reaction_library)
+        SELECT c.user_id, c.goal_id, '{{}}', 'library' FROM comments c LIMIT {REACTIONS}""",
+    f"""INSERT INTO comment_subs (user_id, goal_id, last_read_at)
+        SELECT DISTINCT ON (c.user_id, c.goal_id) c.user_id, c.goal_id, c.created_at
+        FROM comments c LIMIT {COMMENT_SUBS}""",
+    """INSERT INTO devices (user_id, os, version, expo_push_token, active)
+       SELECT id, 'os', 'version', 'token-' || id, true FROM users""",
+    # few notifications wait to be sent, and the receipts of all but the last hour are checked
+    f"""INSERT INTO push_outbox (recipient_id, expo_push_token, goal_id, comment_id, message, status, sent_at, ticket_id,
+                                 receipt_checked_at)
+        SELECT u.ids[i % {USERS} + 1], 'token-' || u.ids[i % {USERS} + 1], c.goal_ids[i % {COMMENTS} + 1],
+               c.ids[i % {COMMENTS} + 1], 'message', CASE WHEN i % 100 = 0 THEN 'pending' ELSE 'sent' END,
+               CASE WHEN i % 100 <> 0 THEN now() - i * interval '1 second' END, 'ticket',
+               CASE WHEN i > 3600 THEN now() - i * interval '1 second' + interval '15 minutes' END
+        FROM generate_series(1, {NOTIFICATIONS}) i,
+             (SELECT array_agg(id) ids FROM users) u,
+             (SELECT array_agg(id) ids, array_agg(goal_id) goal_ids FROM comments) c""",
+    "ANALYZE",
+]
+
+
+@pytest.fixture
+def seeded(commit_as_you_go):
+    conn = commit_as_you_go
+    for stmt in SEED:
+        conn.execute(text(stmt))
+    conn.commit()
+
+    user_id = conn.execute(
+        select(tables.follows.c.follower_id).limit(1)).scalar()
+    goal_id, parent_id = conn.execute(
+        select(tables.goals.c.id, tables.goals.c.parent_id).where(tables.goals.c.parent_id != None).limit(1)).one()
+    comment = conn.execute(select(tables.comments).limit(1)).one()
+    return dict(user_id=user_id, goal_id=goal_id, parent_id=parent_id, comment=comment)
+
+
+# hot queries, called with the ids picked by the seeded fixture, and the indexes each must look up
+CASES = {
+    "read_user": (lambda conn, s: api.read_user(conn, id=s["user_id"]), {"users_pkey"}),
+    "search_users": (lambda conn, s: api.search_users(conn, s["user_id"], q="user12"), {"ix_users_username_pattern"}),
+    "read_followers": (lambda conn, s: api.read_followers(conn, s["user_id"]), {"ix_follows_leader_id"}),
+    "read_leaders": (lambda conn, s: api.read_leaders(conn, s["user_id"]), {"uq_follower_leader"}),
+    "read_follow_counts": (lambda conn, s: api.read_follow_counts(conn, s["user_id"]), {"user_stats_pkey"}),
+    "read_goals_by_user": (lambda conn, s: api.read_goals(conn, user_id=s["user_id"]), {"ix_goals_user_id"}),
+    "read_goals_by_parent": (lambda conn, s: api.read_goals(conn, parent_id=s["parent_id"]), {"ix_goals_parent_id"}),
+    "read_goals_by_ids": (
+        lambda conn, s: api.read_goals(conn, goal_ids=[s["goal_id"], s["parent_id"]]), {"goals_pkey"}),
+    "read_goal_tree": (lambda conn, s: api.read_goal_tree(conn, s["parent_id"]), {"ix_goals_parent_id"}),
+    "read_feed": (
+        lambda conn, s: api.read_feed(conn, s["user_id"]), {"ix_goals_announcements", "ix_reactions_goal_id"}),
+    "read_comments_by_goal": (
+        lambda conn, s: api.read_comments(conn, goal_id=s["comment"].goal_id), {"ix_comments_goal_id"}),
+    "read_comments_by_user": (lambda conn, s: api.read_comments(conn, user_id=s["user_id"]), {"ix_comments_user_id"}),
+    "read_comment_counts": (
+        lambda conn, s: api.read_comment_counts(conn, [s["goal_id"], s["parent_id"]]), {"goals_pkey"}),
+    "read_unread_comment_count": (
+        lambda conn, s: api.read_unread_comment_count(conn, s["user_id"]), {"uq_user_goal", "ix_comments_goal_id"}),
+    "read_unread_comments": (
+        lambda conn, s: api.read_unread_comments(conn, s["user_id"]), {"uq_user_goal", "ix_comments_goal_id"}),
+    "update_read_watermarks": (
+        lambda conn, s: api.update_read_watermarks(conn, s["user_id"], [s["comment"].id]),
+        {"comments_pkey", "ix_comment_subs_goal_id"}),
+    "push_notify_unread_comments": (
+        lambda conn, s: api.push_notify_unread_comments(conn, s["comment"]),
+        {"ix_comment_subs_goal_id", "ix_devices_user_id"}),
+    "create_comment_and_notify": (
+        lambda conn, s: api.create_comment_and_notify(
+            conn, domain.Comment(user_id=s["user_id"], goal_id=s["goal_id"], comment="comment")),
+        {"ix_comment_subs_goal_id", "ix_devices_user_id"}),
+    "read_devices": (lambda conn, s: api.read_devices(conn, [s["user_id"]]), {"ix_devices_user_id"}),
+    "claim_push_notifications": (
+        lambda conn, s: api.claim_push_notifications(conn, 500, timedelta(minutes=5), timedelta(seconds=30)),
+        {"ix_push_outbox_pending"}),
+    "read_push_counts": (
+        lambda conn, s: api.read_push_counts(conn, [s["user_id"]], timedelta(minutes=1)),
+        {"ix_push_outbox_sent_by_recipient"}),
+    "claim_push_receipts": (
+        lambda conn, s: api.claim_push_receipts(conn, 1000, timedelta(minutes=15)),
+        {"ix_push_outbox_unchecked_receipts"}),
+}
+
+
+def capture_statements(conn, fn) -> list[tuple[str, dict]]:
+    """Run fn and return the sql statements it executed, with their parameters"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(conn, "before_cursor_execute", before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(conn, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def plan_nodes(plan: dict) -> list[dict]:
+    """The nodes of a plan, depth first"""
+    nodes = [plan]
+    for child in plan.get("Plans", []):
+        nodes += plan_nodes(child)
+    return nodes
+
+
+def plan_problems(nodes: list[dict], indexes: set[str]) -> list[str]:
+    """The seq scans, the index scans without an Index Cond, and the expected indexes that are not looked up"""
+    problems = []
+    looked_up = set()
+    for node in nodes:
+        if node["Node Type"] == "Seq Scan":
+            problems.append(f"seq scan on {node['Relation Name']}")
+        elif node["Node Type"] in ("Index Scan", "Index Only Scan", "Bitmap Index Scan"):
+            if "Index Cond" in node:
+                looked_up.add(node["Index Name"])
+            else:
+                problems.append(f"full scan of {node['Index Name']}, filtering {node.get('Filter')}")
+    problems += [f"{index} not looked up" for index in sorted(indexes - looked_up)]
+    return problems
+
+
+def test_hot_queries_use_indexes(seeded, commit_as_you_go):
+    conn = commit_as_you_go
+    # the db is seeded once for all cases, since seeding dominates the run time
+    problems = {}
+    for case, (fn, indexes) in CASES.items():
+        statements = capture_statements(conn, lambda: fn(conn, seeded))
+        assert statements, case
+
+        nodes = []
+        for statement, parameters in statements:
+            plan = conn.exec_driver_sql("EXPLAIN (FORMAT JSON) " + statement, parameters).scalar()
+            nodes += plan_nodes(plan[0]["Plan"])
+        if case_problems := plan_problems(nodes, indexes):
+            problems[case] = case_problems
+        conn.rollback()
+
+    assert problems == {}
@@ -0,0 +1,289 @@
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import patch
+from uuid import UUID, uuid4
+
+from fastapi.testclient import TestClient
+import psycopg
+from psycopg.pq import PipelineStatus
+from pydantic import BaseModel, Field, TypeAdapter, field_serializer
+import pytest
+from sqlalchemy import event, make_url, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from src.app import app, READ_YOUR_WRITES_COOKIE
+from src.config import get_config
+from src.responses import ORJSONResponse
+from src.api import create_comment, read_comment_count, read_follow_counts
+from src.sqlalchemy import utils as db_utils
+from src.sqlalchemy.connection import (
+    async_url, begin_read_only, connect_read, create_async_engine_from_config, support_pipelines)
+from src.types import domain
+from tests import utils
+
+
+@pytest.fixture
+def client():
+    # the context manager runs the lifespan, which disposes the async engine's connections on exit
+    with TestClient(app) as client:
+        yield client
+
+
+def test_user_routes(client):
+    response = client.post("/0/users", json={"username": "user0", "email": "u0@a.b"})
+    assert response.status_code == 200
+    user = response.json()
+
+    response = client.get(f"/0/users/{user['id']}")
+    assert response.status_code == 200
+    assert response.json()["username"] == "user0"
+
+    response = client.get("/0/users", params={"username": "nobody"})
+    assert response.status_code == 404
+
+
+def test_goal_with_milestones_route(client, commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    response = client.post("/0/goals/milestones", json={
+        "user_id": str(u0.id), "description": "goal",
+        "milestones": [{"description": "first"}, {"description": "second", "is_completed": True}]})
+    assert response.status_code == 200
+    goal, *milestones = response.json()
+    assert [m["description"] for m in milestones] == ["first", "second"]
+    assert all(m["parent_id"] == goal["id"] for m in milestones)
+
+    response = client.post("/0/goals/milestones", json={
+        "user_id": str(u0.id), "description": "goal", "milestones": [{"description": ""}]})
+    assert response.status_code == 422
+
+
+def test_goal_tree_route(client, commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    goal, *_ = client.post("/0/goals/milestones", json={
+        "user_id": str(u0.id), "description": "goal",
+        "milestones": [{"description": "first", "is_completed": True}, {"description": "second"}]}).json()
+
+    response = client.get(f"/0/goals/{goal['id']}/tree")
+    assert response.status_code == 200
+    tree = response.json()
+    assert (tree["milestone_count"], tree["completed_milestone_count"]) == (2, 1)
+    assert {m["description"] for m in tree["milestones"]} == {"first", "second"}
+
+    response = client.get(f"/0/goals/{goal['id']}/tree", params={"max_depth": 0})
+    assert response.json()["milestones"] == []
+    assert client.get(f"/0/goals/{u0.id}/tree").status_code == 404
+
+
+def test_feed_route_pages_with_cursor(client, commit_as_you_go):
+    u0, _ = utils.create_users_for_tests(commit_as_you_go, count=2)
+    utils.create_goals_for_tests(commit_as_you_go, [u0], count=3)
+
+    response = client.get(f"/0/feed/{u0.id}", params={"limit": 2})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"/0/feed/{u0.id}", params={"limit": 2, "cursor": cursor})
+    assert len(response.json()) == 1
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get(f"/0/feed/{u0.id}", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_search_route_pages_with_cursor(client, commit_as_you_go):
+    u0, *_ = utils.create_users_for_tests(commit_as_you_go, count=4)
+
+    response = client.get(f"/0/users/search/{u0.id}", params={"limit": 2})
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(f"/0/users/search/{u0.id}", params={"limit": 2, "cursor": cursor})
+    assert len(response.json()) == 1
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get(f"/0/users/search/{u0.id}", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+def test_comment_route_queues_push_notifications(client, commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    response = client.post("/0/goals", json={"user_id": str(u0.id), "description": "goal"})
+    assert response.status_code == 200
+    goal = response.json()
+    client.post("/0/devices", json={
+        "user_id": str(u0.id), "os": "os", "version": "version", "expo_push_token": "token0"})
+
+    response = client.post("/0/comments", json={"user_id": str(u1.id), "goal_id": goal["id"], "comment": "nice"})
+    assert response.status_code == 200
+
+    response = client.get("/0/comments/unread/count/" + str(u0.id))
+    assert response.json() == 1
+
+
+def test_orjson_response_matches_pydantic_serialization():
+    class Model(BaseModel):
+        id: UUID = Field(alias="modelId")
+        secret: str = Field(exclude=True)
+        created_at: datetime
+
+        @field_serializer("created_at")
+        def date_only(self, created_at: datetime) -> str:
+            return created_at.date().isoformat()
+
+    now = datetime.now(timezone.utc)
+    models = [
+        Model(modelId=uuid4(), secret="secret", created_at=now),
+        # built from a row whose columns are not in field order
+        db_utils.from_row(domain.Comment, dict(
+            created_at=now, updated_at=now, comment="comment", goal_id=uuid4(), user_id=uuid4(), id=uuid4())),
+    ]
+    # FastAPI serializes response models by alias
+    expected = [TypeAdapter(type(model)).dump_json(model, by_alias=True) for model in models]
+    assert [ORJSONResponse(model).body for model in models] == expected
+
+
+@pytest.fixture
+def db_timezone_not_utc(commit_as_you_go):
+    """Sessions default to a TimeZone other than UTC, unless the engine sets it"""
+    conn = commit_as_you_go
+    database = conn.execute(text("SELECT current_database()")).scalar()
+    conn.execute(text(f"ALTER DATABASE \"{database}\" SET timezone = 'America/New_York'"))
+    conn.commit()
+    yield
+    conn.rollback()
+    conn.execute(text(f"ALTER DATABASE \"{database}\" RESET timezone"))
+    conn.commit()
+
+
+@pytest.mark.parametrize("driver", ["postgresql+asyncpg", "postgresql+psycopg"])
+def test_list_routes_render_same_json_in_db(client, commit_as_you_go, db_timezone_not_utc, driver):
+    url = make_url(get_config()["db"]["url"]).set(drivername=driver).render_as_string(hide_password=False)
+    primary = create_async_engine_from_config({**get_config()["db"], "url": url}, driver)
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    utils.create_follows_for_tests(commit_as_you_go, [u0, u1])
+    goals = utils.create_goals_for_tests(commit_as_you_go, [u0, u1], count=2)
+    utils.create_milestones_for_tests(commit_as_you_go, goals, count=1)
+    utils.create_comments_for_tests(commit_as_you_go, u1, goals, count=2)
+
+    with (patch("src.sqlalchemy.connection.async_engine", primary),
+          patch("src.sqlalchemy.connection.replica_engine", primary)):
+        for url, params in [
+                ("/0/goals", {"user_id": str(u0.id)}),
+                (f"/0/goals/announcements/{u0.id}", {}),
+                ("/0/comments", {"user_id": str(u1.id)}),
+                (f"/0/users/followers/{u0.id}", {})]:
+            params["limit"] = 3
+            with patch("src.routes.v0.RENDER_JSON_IN_DB", False):
+                expected = client.get(url, params=params)
+            with patch("src.routes.v0.RENDER_JSON_IN_DB", True):
+                response = client.get(url, params=params)
+            assert response.status_code == 200
+            assert response.content == expected.content, url
+            assert response.headers.get("X-Next-Cursor") == expected.headers.get("X-Next-Cursor")
+            assert response.headers["content-type"] == expected.headers["content-type"]
+    # the pooled connections belong to the client's event loop
+    client.portal.call(primary.dispose)
+
+
+def test_reads_go_to_replica_unless_client_wrote_recently(client, commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    # a second engine on the same db stands in for the replica
+    replica = create_async_engine(async_url(get_config()["db"]["url"]), poolclass=NullPool)
+    replica_reads = []
+    event.listen(replica.sync_engine, "before_cursor_execute", lambda *args: replica_reads.append(args[2]))
+
+    with patch("src.sqlalchemy.connection.replica_engine", replica):
+        assert client.get(f"/0/users/{u0.id}").status_code == 200
+        assert len(replica_reads) == 1
+
+        # a failed write wrote nothing, so reads stay on the replica
+        response = client.post("/0/follows", json={"follower_id": str(u0.id)})
+        assert response.status_code == 422
+        assert READ_YOUR_WRITES_COOKIE not in response.cookies
+        assert client.get(f"/0/users/{u0.id}").status_code == 200
+        assert len(replica_reads) == 2
+
+        response = client.post("/0/follows", json={"follower_id": str(u0.id), "leader_id": str(u1.id)})
+        assert response.status_code == 200
+        assert len(replica_reads) == 2
+        assert READ_YOUR_WRITES_COOKIE in response.cookies
+
+        # read your writes from the primary until the cookie expires
+        assert client.get(f"/0/follows/counts/{u1.id}").json()["followers"] == 1
+        assert len(replica_reads) == 2
+
+        client.cookies.clear()
+        assert client.get(f"/0/follows/counts/{u1.id}").status_code == 200
+        assert len(replica_reads) == 3
+
+
+def test_read_connections_skip_write_transactions():
+    replica = create_async_engine(async_url(get_config()["db"]["url"]), poolclass=NullPool)
+
+    async def read(connect, sql):
+        async with connect() as conn:
+            return [(await conn.execute(text(sql))).scalar() for _ in range(2)]
+
+    with patch("src.sqlalchemy.connection.replica_engine", replica):
+        # each statement commits on its own, without a BEGIN
+        first, second = asyncio.run(read(connect_read, "SELECT pg_current_xact_id()"))
+        assert first != second
+
+        assert asyncio.run(read(begin_read_only, "SHOW transaction_read_only")) == ["on", "on"]
+        first, second = asyncio.run(read(begin_read_only, "SELECT now()"))
+        assert first == second
+
+
+def test_write_routes_pipeline_statements_with_psycopg(client, commit_as_you_go):
+    u0, u1 = utils.create_users_for_tests(commit_as_you_go, count=2)
+    g0 = utils.create_goals_for_tests(commit_as_you_go, [u0], count=1)[0]
+    create_comment(commit_as_you_go, domain.Comment(user_id=u1.id, goal_id=g0.id, comment="nice"))
+    commit_as_you_go.commit()
+    url = make_url(get_config()["db"]["url"]).set(drivername="postgresql+psycopg")
+    primary = create_async_engine(async_url(url.render_as_string(hide_password=False)), poolclass=NullPool)
+    support_pipelines(primary.sync_engine)
+    pipeline_status = []
+    event.listen(primary.sync_engine, "before_cursor_execute",
+                 lambda conn, cursor, *args: pipeline_status.append(cursor.connection.pgconn.pipeline_status))
+    syncs = []
+    sync = psycopg.AsyncPipeline.sync
+
+    async def counted_sync(pipeline):
+        syncs.append(pipeline)
+        await sync(pipeline)
+
+    with (patch("src.sqlalchemy.connection.async_engine", primary),
+          patch.object(psycopg.AsyncPipeline, "sync", counted_sync)):
+        response = client.post("/0/follows", json={"follower_id": str(u0.id), "leader_id": str(u1.id)})
+        assert response.status_code == 200
+        # the insert of the follow waits on the row it returns, the update of the counts does not
+        assert pipeline_status == [PipelineStatus.ON] * 2
+        assert len(syncs) == 1
+
+        pipeline_status.clear()
+        syncs.clear()
+        response = client.delete(f"/0/users/{u1.id}")
+        assert response.status_code == 200
+        # the count updates and the delete are sent together with the COMMIT
+        assert pipeline_status == [PipelineStatus.ON] * 4
+        assert syncs == []
+
+    # the statements that did not wait on their results were committed too
+    assert read_follow_counts(commit_as_you_go, u0.id).leaders == 0
+    assert read_comment_count(commit_as_you_go, g0.id).count == 0
+
+
+def test_metrics_include_pool_usage(client, commit_as_you_go):
+    u0 = utils.create_users_for_tests(commit_as_you_go, count=1)[0]
+    assert client.get(f"/0/users/{u0.id}").status_code == 200
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    metrics = response.text
+    assert 'db_pool_checkouts_total{pool="primary"}' in metrics
+    assert 'db_pool_checkout_wait_seconds_count{pool="primary"}' in metrics
+    assert 'db_pool_held_seconds_count{pool="sync"}' in metrics
+    assert 'db_pool_checked_out{pool="primary"} 0.0' in metrics
@@ -2,6 +2,8 @@ from uuid import UUID
 from datetime import datetime
 from pytz import utc
 
+from exponent_server_sdk import PushMessage, PushTicket
+
 from sqlalchemy import MetaData, delete, insert
 from sqlalchemy.engine import Connection
 
@@ -109,12 +111,10 @@ def create_comment_subs_for_tests(conn: Connection, goal_ids: list[UUID], user_i
     inserted = [domain.CommentSub(**row._mapping) for row in inserted]
     return inserted
 
-def create_unread_comments_for_tests(conn: Connection, comments: list[domain.Comment], user_ids: list[UUID]) -> list[domain.UnreadComment]:
-    unread_comments = []
-    for c in comments:
-        for u in user_ids:
-            unread_comments.append(domain.UnreadComment(comment_id=c.id, goal_id=c.goal_id, user_id=u).model_dump(exclude_none=True))
-    inserted = conn.execute(insert(tables.unread_comments).values(unread_comments).returning(tables.unread_comments)).all()
-    conn.commit()
-    inserted = [domain.UnreadComment(**row._mapping) for row in inserted]
-    return inserted
\ No newline at end of file
+
+def publish_for_tests(messages: list[PushMessage]) -> list[PushTicket]:
+    """Stand-in for PushClient.publish_multiple that accepts every message, except to tokens containing 'dead'."""
+    return [
+        PushTicket(m, PushTicket.ERROR_STATUS, "", {"error": PushTicket.ERROR_DEVICE_NOT_REGISTERED}, "")
+        if "dead" in m.to else PushTicket(m, PushTicket.SUCCESS_STATUS, "", None, f"ticket-{m.to}")
+        for m in messages]